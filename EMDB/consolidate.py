@@ -0,0 +1,238 @@
+# EMDB/consolidate.py
+
+import argparse
+import logging
+import time
+
+from .db import RETRIEVED_METADATA, content_id, db
+
+
+def usage_score(added_at, hits, last_hit, now, half_life_days=30.0):
+    """
+    条目的使用度：命中越多越高，距最近一次使用（或写入）越久越低
+    """
+    last_used = last_hit or added_at or now
+    age_days = max(now - last_used, 0.0) / 86400
+    return (1 + hits) * 0.5 ** (age_days / half_life_days)
+
+
+def cluster_entries(embeddings, merge_distance):
+    """
+    贪心聚类：按顺序把每个条目并入第一个与其中心距离不超过 merge_distance 的簇
+    :return: 每个簇的条目下标列表
+    """
+    import numpy as np
+
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    if len(vectors) == 0:
+        return []
+    norms = (vectors * vectors).sum(axis=1)
+    centers = []  # 每个簇中心（第一个条目）的下标
+    clusters = []
+    for i, vector in enumerate(vectors):
+        if centers:
+            # 用 |a|² + |b|² - 2a·b 一次算出到所有簇中心的 L2 平方距离
+            distances = norms[centers] + norms[i] - 2 * vectors[centers] @ vector
+            close = np.flatnonzero(distances <= merge_distance)
+            if len(close):
+                clusters[close[0]].append(i)
+                continue
+        centers.append(i)
+        clusters.append([i])
+    return clusters
+
+
+def summarize_cluster(llm, documents):
+    instruction = "你是一名法律知识库管理员，负责合并内容相近的条目。"
+    entries = "\n\n".join(f"条目{i + 1}:\n{doc}" for i, doc in enumerate(documents))
+    prompt = (
+        f"以下条目内容相近：\n\n{entries}\n\n"
+        "请把它们合并为一条有代表性的条目，保留所有不重复的关键信息。只输出合并后的内容。"
+    )
+    return llm.generate(instruction, prompt).strip()
+
+
+def _merge_texts(llm, texts):
+    """
+    合并簇中各条目的同一字段；内容相同时直接保留，没有 LLM 时去重后拼接
+    """
+    unique = list(dict.fromkeys(text for text in texts if text))
+    if len(unique) <= 1:
+        return unique[0] if unique else (texts[0] if texts else "")
+    if llm is not None:
+        try:
+            return summarize_cluster(llm, unique)
+        except Exception as e:
+            logging.warning(f"Failed to merge similar entries: {e}")
+    return "\n".join(unique)
+
+
+def merge_metadata(llm, metadatas, retrieved_field=None):
+    """
+    合并簇中各条目的元数据。检索时返回给 Agent 的字段用 LLM 摘要合并，
+    其余文本字段去重后拼接，其他类型的字段保留使用度最高的条目的值
+    :param metadatas: 按使用度从高到低排列的元数据
+    """
+    metadatas = [metadata or {} for metadata in metadatas]
+    merged = dict(metadatas[0])
+    for key in dict.fromkeys(key for metadata in metadatas for key in metadata):
+        values = [metadata[key] for metadata in metadatas if key in metadata]
+        if not all(isinstance(value, str) for value in values):
+            merged.setdefault(key, values[0])
+        elif key == retrieved_field:
+            merged[key] = _merge_texts(llm, values)
+        else:
+            merged[key] = _merge_texts(None, values)
+    return merged or None
+
+
+def consolidate_collection(
+    database,
+    collection_name,
+    capacity,
+    llm=None,
+    merge_distance=0.1,
+    half_life_days=30.0,
+):
+    """
+    条目数超过 capacity 时整理集合：先把相近的条目合并为一条代表条目，
+    仍超出容量时按使用度从低到高淘汰。
+    聚类和 LLM 摘要基于读取时的快照在写锁之外完成，写锁只在删除和写入时持有，
+    整理期间新写入的条目留到下一次整理
+    :param database: EMDB.db.db 实例
+    :param capacity: 集合的容量上限
+    :param llm: 用于生成合并摘要；为 None 时保留簇中使用度最高的条目，
+        并把其他条目元数据中的文本去重后拼接进来
+    :param merge_distance: 视为相近的嵌入距离（L2 平方距离），为 None 时不合并
+    :return: {"merged": 合并掉的条目数, "evicted": 淘汰的条目数}
+    """
+    database.flush(collection_name)
+    collection = database._collection(collection_name)
+    stats = {"merged": 0, "evicted": 0}
+    if collection.count() <= capacity:
+        return stats
+    entries = collection.get(include=["documents", "metadatas", "embeddings"])
+    ids = list(entries["ids"])
+    documents = list(entries["documents"])
+    metadatas = list(entries["metadatas"])
+    embeddings = list(entries["embeddings"])
+
+    now = time.time()
+    usage = database.usage.get(collection_name, ids)
+    # 此前未记录使用情况的条目从现在开始计时
+    unseen = [id for id in ids if id not in usage]
+    database.usage.record_added(collection_name, unseen, now)
+    usage.update({id: (now, 0, None) for id in unseen})
+    scores = {
+        id: usage_score(*usage[id], now, half_life_days=half_life_days) for id in ids
+    }
+
+    merges = []
+    if merge_distance is not None:
+        retrieved_field = RETRIEVED_METADATA.get(collection_name)
+        removed = set()
+        for cluster in cluster_entries(embeddings, merge_distance):
+            if len(cluster) < 2:
+                continue
+            cluster.sort(key=lambda i: scores[ids[i]], reverse=True)
+            members = [ids[i] for i in cluster]
+            keep = cluster[0]
+            document = documents[keep]
+            if llm is not None:
+                document = _merge_texts(llm, [documents[i] for i in cluster])
+            # Agent 检索到的是元数据，合并结果必须写进元数据才能被用上
+            metadata = merge_metadata(
+                llm, [metadatas[i] for i in cluster], retrieved_field
+            )
+            hits = sum(usage[id][1] for id in members)
+            last_hits = [usage[id][2] for id in members if usage[id][2]]
+            last_hit = max(last_hits) if last_hits else None
+
+            if document == documents[keep]:
+                new_id, embedding = ids[keep], embeddings[keep]
+            else:
+                new_id = content_id(document)
+                embedding = database.embedding_fn([document])[0]
+            merges.append(
+                (members, new_id, document, embedding, metadata, hits, last_hit)
+            )
+
+            removed.update(members)
+            removed.discard(new_id)
+            if new_id not in ids:
+                ids.append(new_id)
+            scores[new_id] = usage_score(
+                now, hits, last_hit, now, half_life_days=half_life_days
+            )
+            stats["merged"] += len(members) - 1
+        ids = [id for id in ids if id not in removed]
+
+    evicted = []
+    if len(ids) > capacity:
+        ids.sort(key=lambda id: scores[id])
+        evicted = ids[: len(ids) - capacity]
+        stats["evicted"] = len(evicted)
+
+    # 合并和淘汰各用一次批量删除和写入，尽量缩短持有写锁的时间
+    merged_ids = [id for merge in merges for id in merge[0]]
+    with database._write_lock:
+        if merged_ids:
+            collection.delete(ids=merged_ids)
+            database.usage.remove(collection_name, merged_ids)
+            collection.upsert(
+                ids=[merge[1] for merge in merges],
+                documents=[merge[2] for merge in merges],
+                embeddings=[merge[3] for merge in merges],
+                metadatas=[merge[4] or {} for merge in merges],
+            )
+            for _, new_id, _, _, _, hits, last_hit in merges:
+                # 代表条目继承整个簇的命中次数
+                database.usage.set(collection_name, new_id, now, hits, last_hit)
+        if evicted:
+            collection.delete(ids=evicted)
+            database.usage.remove(collection_name, evicted)
+
+    logging.info(
+        f"Consolidated {database.agent_name}_{collection_name}: "
+        f"{stats['merged']} merged, {stats['evicted']} evicted"
+    )
+    return stats
+
+
+def consolidate_db(database, capacities, llm=None, merge_distance=0.1):
+    """
+    按 capacities（集合名 -> 容量上限）整理一个 Agent 的记忆库
+    """
+    return {
+        name: consolidate_collection(
+            database, name, capacity, llm=llm, merge_distance=merge_distance
+        )
+        for name, capacity in capacities.items()
+        if capacity
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Consolidate and cap an agent's experience and case memory"
+    )
+    parser.add_argument("agents", nargs="+", help="Agent names under db/")
+    parser.add_argument("--experience-cap", type=int, default=None)
+    parser.add_argument("--case-cap", type=int, default=None)
+    parser.add_argument("--merge-distance", type=float, default=0.1)
+    parser.add_argument("--model", default="BAAI/bge-m3")
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    capacities = {"experience": args.experience_cap, "case": args.case_cap}
+    for agent_name in args.agents:
+        database = db(agent_name, args.model, args.device)
+        stats = consolidate_db(
+            database, capacities, merge_distance=args.merge_distance
+        )
+        print(f"{agent_name}: {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,79 @@
 # EMDB/db.py
 
+import atexit
+import hashlib
+import logging
 import os
-import chromadb
-from chromadb.config import Settings
-from chromadb.utils import embedding_functions
+import re
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import measured
+
+from .usage import UsageStats
+
+
+# 经验库和案例库检索时返回给 Agent 的元数据字段（文档本身只用于匹配）
+RETRIEVED_METADATA = {"experience": "context", "case": "response_directions"}
+
+
+def content_id(document):
+    """
+    由规范化后的内容生成条目 ID，内容相同（忽略全半角、大小写和空白差异）的
+    条目 ID 相同，重复写入时会被跳过
+    """
+    normalized = unicodedata.normalize("NFKC", document)
+    normalized = re.sub(r"\s+", " ", normalized).strip().lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def _squared_l2(a, b):
+    return sum((x - y) ** 2 for x, y in zip(a, b))
 
 
 class db:
-    def __init__(self, agent_name, EmbeddingModelName="BAAI/bge-m3", device="cpu"):
+    def __init__(
+        self,
+        agent_name,
+        EmbeddingModelName="BAAI/bge-m3",
+        device="cpu",
+        buffer_size=32,
+        flush_interval=5.0,
+        dedup_distance=None,
+    ):
+        """
+        :param buffer_size: 写缓冲中累计的条目数达到该值时批量写入
+        :param flush_interval: 缓冲中最早的条目等待超过该秒数时批量写入
+        :param dedup_distance: 与已有条目的嵌入距离（chroma 默认的 L2 平方距离）
+            不超过该值时视为近似重复并跳过写入；为 None 时只跳过内容相同的条目
+        """
         self.agent_name = agent_name
-        self.embedding_fn = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name=EmbeddingModelName, device=device
-        )
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.dedup_distance = dedup_distance
+        # 多个案例并行反思时，串行化对同一数据库的写入
+        self._write_lock = threading.Lock()
+        self._buffer_lock = threading.Lock()
+        self._pending = {"experience": [], "case": [], "legal": []}
+        self._flush_timer = None
+        # chromadb 和嵌入模型只在真正创建数据库时导入
+        from .embedding import get_embedding_function
+
+        self.embedding_fn = get_embedding_function(EmbeddingModelName, device)
         self.client = self._create_client()
+        self.usage = UsageStats(os.path.join("db", agent_name, "usage.sqlite"))
         self.experience_collection = self._create_collection("experience")
         self.case_collection = self._create_collection("case")
         self.legal_collection = self._create_collection("legal")
+        self._query_executor = ThreadPoolExecutor(
+            max_workers=3, thread_name_prefix=f"{agent_name}-query"
+        )
+        atexit.register(self.flush)
 
     def _create_client(self):
+        import chromadb
+
         client_path = os.path.join("db", self.agent_name)
         os.makedirs(client_path, exist_ok=True)
         return chromadb.PersistentClient(path=client_path)
@@ -28,80 +84,255 @@ class db:
             embedding_function=self.embedding_fn,
         )
 
+    def _collection(self, collection_name):
+        return getattr(self, f"{collection_name}_collection")
+
+    def _buffer_add(self, collection_name, id, document, metadata):
+        with self._buffer_lock:
+            self._pending[collection_name].append((id, document, metadata))
+            pending = sum(len(items) for items in self._pending.values())
+            if self._flush_timer is None:
+                self._flush_timer = threading.Timer(self.flush_interval, self.flush)
+                self._flush_timer.daemon = True
+                self._flush_timer.start()
+        if pending >= self.buffer_size:
+            self.flush()
+
+    @measured("db")
     def add_to_experience(self, id, document, metadata=None):
-        self.experience_collection.add(
-            documents=[document], metadatas=[metadata] if metadata else None, ids=[id]
-        )
+        self._buffer_add("experience", id or content_id(document), document, metadata)
 
+    @measured("db")
     def add_to_case(self, id, document, metadata=None):
-        self.case_collection.add(
-            documents=[document], metadatas=[metadata] if metadata else None, ids=[id]
-        )
+        self._buffer_add("case", id or content_id(document), document, metadata)
 
+    @measured("db")
     def add_to_legal(self, id, document, metadata=None):
-        self.legal_collection.add(
-            documents=[document], metadatas=[metadata] if metadata else None, ids=[id]
-        )
+        self._buffer_add("legal", id or content_id(document), document, metadata)
+
+    @measured("db")
+    def flush(self, collection_name=None):
+        """
+        将写缓冲中的条目批量写入
+        :param collection_name: 只写入该集合；为 None 时写入全部
+        """
+        with self._write_lock:
+            with self._buffer_lock:
+                names = [collection_name] if collection_name else list(self._pending)
+                batches = {name: self._pending[name] for name in names}
+                for name in names:
+                    self._pending[name] = []
+                if not any(self._pending.values()) and self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+            for name, items in batches.items():
+                if not items:
+                    continue
+                try:
+                    self._write_batch(name, items)
+                except Exception:
+                    # 写入失败时放回缓冲，避免丢失
+                    with self._buffer_lock:
+                        self._pending[name] = items + self._pending[name]
+                    raise
+            self.usage.flush()
+
+    def _write_batch(self, collection_name, items):
+        collection = self._collection(collection_name)
+        # 同一 ID 只写入一次：跳过批内重复和库中已有的条目
+        unique = {}
+        for item in items:
+            unique.setdefault(item[0], item)
+        existing = set(collection.get(ids=list(unique), include=[])["ids"])
+        items = [item for id, item in unique.items() if id not in existing]
+        if not items:
+            return
+        # 整批文档一次嵌入
+        embeddings = self.embedding_fn([document for _, document, _ in items])
+        if self.dedup_distance is not None:
+            items, embeddings = self._drop_near_duplicates(
+                collection, items, embeddings
+            )
+        # chroma 要求同一次 add 的 metadatas 要么全部给出、要么全部为空
+        with_metadata = [i for i, item in enumerate(items) if item[2]]
+        without_metadata = [i for i, item in enumerate(items) if not item[2]]
+        for indices in (with_metadata, without_metadata):
+            if not indices:
+                continue
+            metadatas = [items[i][2] for i in indices]
+            collection.add(
+                ids=[items[i][0] for i in indices],
+                documents=[items[i][1] for i in indices],
+                embeddings=[embeddings[i] for i in indices],
+                metadatas=metadatas if indices is with_metadata else None,
+            )
+        self.usage.record_added(collection_name, [id for id, _, _ in items])
 
+    def _drop_near_duplicates(self, collection, items, embeddings):
+        """
+        去掉与库中已有条目或本批中更早条目嵌入距离过近的条目
+        """
+        nearest = [None] * len(items)
+        if collection.count():
+            result = collection.query(
+                query_embeddings=list(embeddings), n_results=1, include=["distances"]
+            )
+            nearest = [d[0] if d else None for d in result["distances"]]
+        kept_items, kept_embeddings = [], []
+        for item, embedding, distance in zip(items, embeddings, nearest):
+            duplicate = distance is not None and distance <= self.dedup_distance
+            duplicate = duplicate or any(
+                _squared_l2(embedding, other) <= self.dedup_distance
+                for other in kept_embeddings
+            )
+            if duplicate:
+                logging.debug(f"Skipping near-duplicate entry {item[0]}")
+                continue
+            kept_items.append(item)
+            kept_embeddings.append(embedding)
+        return kept_items, kept_embeddings
+
+    def _flush_before_read(self, collection_name):
+        # 保证读到此前写入（仍在缓冲中）的条目
+        if self._pending[collection_name]:
+            self.flush(collection_name)
+
+    def _record_hit(self, collection_name, result, index):
+        # 记录实际返回给调用方的条目，供容量淘汰时计算使用度
+        if index is not None:
+            self.usage.record_hit(collection_name, result["ids"][0][index])
+
+    @staticmethod
+    def _first_document_index(result):
+        documents = (result.get("documents") or [[]])[0]
+        return 0 if documents else None
+
+    @staticmethod
+    def _first_metadata_index(result, key):
+        metadatas = (result.get("metadatas") or [[]])[0]
+
+        # 查找包含 key 的第一个字典
+        for i, metadata in enumerate(metadatas):
+            if metadata and key in metadata:
+                return i
+        return None
+
+    def _document_result(self, collection_name, result):
+        index = self._first_document_index(result)
+        self._record_hit(collection_name, result, index)
+        return result["documents"][0][index] if index is not None else ""
+
+    def _metadata_result(self, collection_name, result, key):
+        index = self._first_metadata_index(result, key)
+        self._record_hit(collection_name, result, index)
+        # 如果没有找到包含 key 的字典，返回空字符串
+        return result["metadatas"][0][index][key] if index is not None else ""
+
+    @measured("db")
     def query_experience(self, query_text, n_results=5, include=["documents"]):
+        self._flush_before_read("experience")
         result = self.experience_collection.query(
             query_texts=[query_text], n_results=n_results, include=include
         )
-        documents = result.get("documents", [[]])[0]
-        return documents[0] if documents else ""
+        return self._document_result("experience", result)
 
+    @measured("db")
     def query_experience_metadatas(self, query_text, n_results=5):
+        self._flush_before_read("experience")
         result = self.experience_collection.query(
             query_texts=[query_text], n_results=n_results, include=["metadatas"]
         )
-        metadatas = result.get("metadatas", [[]])[0]
-
-        # 查找包含 "context" 键的第一个字典
-        for metadata in metadatas:
-            if "context" in metadata:
-                return metadata["context"]
-
-        # 如果没有找到包含 "context" 的字典，返回空字符串
-        return ""
+        return self._metadata_result(
+            "experience", result, RETRIEVED_METADATA["experience"]
+        )
 
+    @measured("db")
     def query_experience_documents(self, query_text, n_results=5):
+        self._flush_before_read("experience")
         result = self.experience_collection.query(
             query_texts=[query_text], n_results=n_results, include=["documents"]
         )
-        documents = result.get("documents", [[]])[0]
-        return documents[0] if documents else ""
+        return self._document_result("experience", result)
 
+    @measured("db")
     def query_case(self, query_text, n_results=5, include=["documents"]):
+        self._flush_before_read("case")
         result = self.case_collection.query(
             query_texts=[query_text], n_results=n_results, include=include
         )
-        documents = result.get("documents", [[]])[0]
-        return documents[0] if documents else ""
+        return self._document_result("case", result)
 
+    @measured("db")
     def query_case_documents(self, query_text, n_results=5):
+        self._flush_before_read("case")
         result = self.case_collection.query(
             query_texts=[query_text], n_results=n_results, include=["documents"]
         )
-        documents = result.get("documents", [[]])[0]
-        return documents[0] if documents else ""
+        return self._document_result("case", result)
 
+    @measured("db")
     def query_case_metadatas(self, query_text, n_results=5):
+        self._flush_before_read("case")
         result = self.case_collection.query(
             query_texts=[query_text], n_results=n_results, include=["metadatas"]
         )
-        metadatas = result.get("metadatas", [[]])[0]
-
-        # 查找包含 "context" 键的第一个字典
-        for metadata in metadatas:
-            if "response_directions" in metadata:
-                return metadata["response_directions"]
-
-        # 如果没有找到包含 "context" 的字典，返回空字符串
-        return ""
+        return self._metadata_result("case", result, RETRIEVED_METADATA["case"])
 
+    @measured("db")
     def query_legal(self, query_text, n_results=5, include=["documents"]):
+        self._flush_before_read("legal")
         result = self.legal_collection.query(
             query_texts=[query_text], n_results=n_results, include=include
         )
-        documents = result.get("documents", [[]])[0]
-        return documents[0] if documents else ""
+        return self._document_result("legal", result)
+
+    @staticmethod
+    def _query_text(query):
+        # Agent 生成的查询通常是 {"query": "..."} 形式的 JSON
+        if isinstance(query, dict):
+            return str(query.get("query", query))
+        return str(query)
+
+    @measured("db")
+    def query_all(self, queries, n_results=5):
+        """
+        一次性检索经验库、案例库和法条库
+        :param queries: 以 experience / case / legal 为键的查询文本
+        :return: 与 query_experience_metadatas、query_case_metadatas、query_legal
+            结果相同的上下文，键与 queries 一致
+        """
+        # collection 名称, 结果字段, 提取方式
+        targets = {
+            "experience": (
+                self.experience_collection,
+                "metadatas",
+                RETRIEVED_METADATA["experience"],
+            ),
+            "case": (self.case_collection, "metadatas", RETRIEVED_METADATA["case"]),
+            "legal": (self.legal_collection, "documents", None),
+        }
+        names = [name for name in targets if name in queries]
+        if not names:
+            return {}
+        for name in names:
+            self._flush_before_read(name)
+
+        # 所有查询文本合并为一次嵌入计算
+        embeddings = self.embedding_fn(
+            [self._query_text(queries[name]) for name in names]
+        )
+
+        def run(name, embedding):
+            collection, field, key = targets[name]
+            result = collection.query(
+                query_embeddings=[embedding], n_results=n_results, include=[field]
+            )
+            if key is None:
+                return self._document_result(name, result)
+            return self._metadata_result(name, result, key)
+
+        futures = {
+            name: self._query_executor.submit(run, name, embedding)
+            for name, embedding in zip(names, embeddings)
+        }
+        return {name: future.result() for name, future in futures.items()}
@@ -0,0 +1,108 @@
+# EMDB/embedding.py
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from chromadb import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils import embedding_functions
+
+
+class SharedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    进程内共享的嵌入函数。模型在首次调用时加载；并发调用方的请求先进入队列，
+    在 max_wait 秒的窗口内合并成一次前向计算。
+    """
+
+    def __init__(self, model_name, device="cpu", max_batch_size=64, max_wait=0.01):
+        self.model_name = model_name
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._model = None
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def __call__(self, input: Documents) -> Embeddings:
+        documents = list(input)
+        if not documents:
+            return []
+        future = Future()
+        self._queue.put((documents, future))
+        self._ensure_worker()
+        return future.result()
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(
+                        target=self._run,
+                        name=f"embedding-{self.model_name}",
+                        daemon=True,
+                    )
+                    self._worker.start()
+
+    def _embed(self, documents):
+        if self._model is None:
+            self._model = embedding_functions.SentenceTransformerEmbeddingFunction(
+                model_name=self.model_name, device=self.device
+            )
+        return self._model(documents)
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        size = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            documents = [doc for docs, _ in batch for doc in docs]
+            try:
+                embeddings = self._embed(documents)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for docs, future in batch:
+                future.set_result(embeddings[offset : offset + len(docs)])
+                offset += len(docs)
+
+
+_shared_functions = {}
+_shared_lock = threading.Lock()
+
+
+def get_embedding_function(model_name="BAAI/bge-m3", device="cpu"):
+    """
+    获取进程内共享的嵌入函数，同一模型和设备只加载一次
+    """
+    key = (model_name, device)
+    with _shared_lock:
+        if key not in _shared_functions:
+            _shared_functions[key] = SharedEmbeddingFunction(model_name, device)
+        return _shared_functions[key]
+
+
+def set_embedding_function(embedding_fn, model_name="BAAI/bge-m3", device="cpu"):
+    """
+    用自定义的嵌入函数替换 (模型, 设备) 对应的共享嵌入函数，之后创建的数据库都会使用它
+    """
+    with _shared_lock:
+        _shared_functions[(model_name, device)] = embedding_fn
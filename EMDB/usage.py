@@ -0,0 +1,105 @@
+# EMDB/usage.py
+
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+
+class UsageStats:
+    """
+    记录每个条目的写入时间、命中次数和最近命中时间，供容量淘汰使用。
+    命中先累计在内存中，flush 时批量写入 SQLite。
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._pending = defaultdict(lambda: [0, 0.0])  # (集合, ID) -> [命中数, 时间]
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS usage ("
+            "collection TEXT NOT NULL, id TEXT NOT NULL, added_at REAL NOT NULL, "
+            "hits INTEGER NOT NULL DEFAULT 0, last_hit REAL, "
+            "PRIMARY KEY (collection, id))"
+        )
+        self._conn.commit()
+
+    def record_added(self, collection_name, ids, added_at=None):
+        added_at = added_at or time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO usage (collection, id, added_at) "
+                "VALUES (?, ?, ?)",
+                [(collection_name, id, added_at) for id in ids],
+            )
+            self._conn.commit()
+
+    def record_hit(self, collection_name, id):
+        with self._lock:
+            pending = self._pending[(collection_name, id)]
+            pending[0] += 1
+            pending[1] = time.time()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            rows = [
+                (collection_name, id, last_hit, hits, last_hit)
+                for (collection_name, id), (hits, last_hit) in self._pending.items()
+            ]
+            self._pending.clear()
+            # 写入前就已存在的条目没有写入时间，以首次命中时间代替
+            self._conn.executemany(
+                "INSERT INTO usage (collection, id, added_at, hits, last_hit) "
+                "VALUES (?, ?, ?, ?, ?) ON CONFLICT(collection, id) DO UPDATE SET "
+                "hits = hits + excluded.hits, last_hit = excluded.last_hit",
+                rows,
+            )
+            self._conn.commit()
+
+    def get(self, collection_name, ids):
+        """
+        :return: ID -> (写入时间, 命中次数, 最近命中时间)，未记录的条目不在结果中
+        """
+        self.flush()
+        result = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                chunk = ids[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT id, added_at, hits, last_hit FROM usage "
+                    f"WHERE collection = ? AND id IN ({placeholders})",
+                    [collection_name, *chunk],
+                )
+                for id, added_at, hits, last_hit in rows:
+                    result[id] = (added_at, hits, last_hit)
+        return result
+
+    def set(self, collection_name, id, added_at, hits=0, last_hit=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO usage "
+                "(collection, id, added_at, hits, last_hit) VALUES (?, ?, ?, ?, ?)",
+                (collection_name, id, added_at, hits, last_hit),
+            )
+            self._conn.commit()
+
+    def remove(self, collection_name, ids):
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM usage WHERE collection = ? AND id = ?",
+                [(collection_name, id) for id in ids],
+            )
+            self._conn.commit()
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
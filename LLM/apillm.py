@@ -1,33 +1,77 @@
 from .llm import LLM
+from .rate_limit import configure_rate_limit
+from .resilience import RetryPolicy
 from .openai_client import OpenAIClient
 from .wenxin_client import WenxinClient
 from .zhipuai_client import ZhipuAIClient
 
 
 class APILLM(LLM):
-    def __init__(self, api_key, api_secret=None, platform="wenxin", model="gpt-4"):
+    def __init__(
+        self,
+        api_key,
+        api_secret=None,
+        platform="wenxin",
+        model="gpt-4",
+        max_concurrency=8,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        request_timeout=60.0,
+        max_retries=3,
+        hedge_after=None,
+    ):
+        """
+        :param request_timeout: 单次请求的超时时间（秒）
+        :param max_retries: 连接错误、超时和 5xx 的最大重试次数
+        :param hedge_after: 对冲请求的触发时间（秒），"p95" 表示按近期耗时的
+            95 分位数触发，None 表示不对冲
+        """
         self.api_key = api_key
         self.api_secret = api_secret
         self.platform = platform
         self.model = model
+        self.max_concurrency = max_concurrency
         self.client = self._initialize_client()
+        self.client.retry_policy = RetryPolicy(
+            timeout=request_timeout, max_retries=max_retries
+        )
+        self.client.hedge_after = hedge_after
+        # 同一进程内相同平台和模型的所有客户端共用一个限流器
+        configure_rate_limit(platform, model, requests_per_minute, tokens_per_minute)
 
     def _initialize_client(self):
         if self.platform == "openai":
-            return OpenAIClient(self.api_key, self.model)
+            return OpenAIClient(self.api_key, self.model, self.max_concurrency)
         elif self.platform == "wenxin":
-            return WenxinClient(self.api_key, self.api_secret, self.model)
+            return WenxinClient(
+                self.api_key, self.api_secret, self.model, self.max_concurrency
+            )
         elif self.platform == "zhipuai":
-            return ZhipuAIClient(self.api_key, self.model)
+            return ZhipuAIClient(self.api_key, self.model, self.max_concurrency)
         else:
             raise ValueError(f"Unsupported platform: {self.platform}")
 
-    def generate(self, instruction, prompt, *args, **kwargs):
+    @staticmethod
+    def _build_messages(instruction, prompt):
         if instruction is None:
             instruction = "You are a helpful assistant."
 
-        messages = [
+        return [
             {"role": "system", "content": instruction},
             {"role": "user", "content": prompt},
         ]
+
+    def generate(self, instruction, prompt, *args, **kwargs):
+        messages = self._build_messages(instruction, prompt)
         return self.client.send_request(messages, *args, **kwargs)
+
+    def stream(self, instruction, prompt, *args, **kwargs):
+        messages = self._build_messages(instruction, prompt)
+        yield from self.client.stream_request(messages, *args, **kwargs)
+
+    async def agenerate(self, instruction, prompt, *args, **kwargs):
+        messages = self._build_messages(instruction, prompt)
+        return await self.client.asend_request(messages, *args, **kwargs)
+
+    async def aclose(self):
+        await self.client.aclose()
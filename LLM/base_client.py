@@ -1,9 +1,319 @@
 # LLM/base_client.py
+import asyncio
+import json
+import threading
+import time
+import weakref
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from typing import List, Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .rate_limit import get_rate_limiter
+from .resilience import LatencyTracker, RetryPolicy, check_deadline, run_in_context
 
 
 class BaseClient(ABC):
+    # 平台名，与模型名一起作为进程内共享限流器的键
+    platform = None
+    # 收到 429 后最多重试的次数
+    max_rate_limit_retries = 5
+    # 超时与瞬时错误（连接错误、超时、5xx）的重试策略
+    retry_policy = RetryPolicy()
+    # 请求超过该秒数仍未返回时再发一个相同的请求，取先返回者；
+    # "p95" 表示使用近期耗时的 95 分位数，None 表示不对冲
+    hedge_after = None
+
+    def __init__(self, max_concurrency: int = 8):
+        """
+        :param max_concurrency: 同时在途的请求上限，同时也是连接池大小
+        """
+        self.max_concurrency = max_concurrency
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._sync_slots = threading.BoundedSemaphore(max_concurrency)
+        # aiohttp 的会话与事件循环绑定，因此按事件循环分别维护
+        self._async_sessions = weakref.WeakKeyDictionary()
+        self.latency = LatencyTracker()
+        self._hedge_executor = None
+
     @abstractmethod
     def send_request(self, messages: List[Dict[str, str]], *args, **kwargs):
         pass
+
+    @abstractmethod
+    async def asend_request(self, messages: List[Dict[str, str]], *args, **kwargs):
+        pass
+
+    def stream_request(self, messages: List[Dict[str, str]], *args, **kwargs):
+        """
+        流式请求，逐段产出生成的文本；提前结束迭代会关闭连接
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support streaming")
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        带 keep-alive 连接池的同步会话，在所有线程间共享
+        """
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=1, pool_maxsize=self.max_concurrency
+                    )
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    @property
+    def rate_limiter(self):
+        return get_rate_limiter(self.platform, self.model)
+
+    @staticmethod
+    def _estimate_tokens(payload: Dict) -> int:
+        # 按字符数估计，中文约一字一个 token，对英文偏保守
+        text = payload.get("system") or ""
+        for message in payload.get("messages", []):
+            text += message.get("content") or ""
+        return len(text)
+
+    @staticmethod
+    def _record_usage(limiter, text: str, estimated: int):
+        """
+        用响应中的实际 token 用量修正预估值
+        """
+        try:
+            usage = json.loads(text).get("usage") or {}
+        except (ValueError, AttributeError):
+            return
+        total_tokens = usage.get("total_tokens")
+        if total_tokens:
+            limiter.consume(total_tokens - estimated)
+
+    def _hedge_delay(self):
+        if self.hedge_after == "p95":
+            return self.latency.percentile(0.95)
+        return self.hedge_after
+
+    def _send_once(self, url, headers, payload, estimated, **kwargs):
+        self.rate_limiter.acquire(estimated)
+        timeout = self.retry_policy.request_timeout()
+        with self._sync_slots:
+            start = time.monotonic()
+            response = self.session.post(
+                url,
+                headers=headers,
+                data=json.dumps(payload),
+                timeout=timeout,
+                **kwargs,
+            )
+        self.latency.record(time.monotonic() - start)
+        self.rate_limiter.update_from_headers(response.headers, response.status_code)
+        return response
+
+    def _send_hedged(self, *args, **kwargs):
+        delay = self._hedge_delay()
+        if delay is None:
+            return self._send_once(*args, **kwargs)
+
+        if self._hedge_executor is None:
+            with self._session_lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = ThreadPoolExecutor(
+                        max_workers=2 * self.max_concurrency,
+                        thread_name_prefix=f"{self.platform}-hedge",
+                    )
+        first = run_in_context(self._hedge_executor, self._send_once, *args, **kwargs)
+        if wait([first], timeout=delay).done:
+            return first.result()
+
+        # 第一个请求迟迟未返回，发出对冲请求，取先成功的结果
+        second = run_in_context(self._hedge_executor, self._send_once, *args, **kwargs)
+        error = None
+        for future in as_completed([first, second]):
+            try:
+                return future.result()
+            except Exception as e:
+                error = e
+        raise error
+
+    def _request_with_retries(self, send, *args, **kwargs):
+        """
+        调用 send 发送请求；限流时等待限流器放行后重试，瞬时错误按指数退避重试
+        """
+        policy = self.retry_policy
+        attempt = 0
+        rate_limited = 0
+        while True:
+            check_deadline()
+            try:
+                response = send(*args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= policy.max_retries:
+                    raise
+                print(f"警告:请求失败，准备重试: {e}")
+            else:
+                if (
+                    response.status_code == 429
+                    and rate_limited < self.max_rate_limit_retries
+                ):
+                    # 限流器已根据响应暂停，直接重试即可
+                    print("警告:请求速率超过限制!")
+                    rate_limited += 1
+                    response.close()
+                    continue
+                if response.status_code < 500 or attempt >= policy.max_retries:
+                    return response
+                print(f"警告:服务端错误 {response.status_code}，准备重试")
+                response.close()
+            time.sleep(policy.backoff(attempt))
+            attempt += 1
+
+    def _post(self, url: str, headers: Dict[str, str], payload: Dict, **kwargs):
+        estimated = self._estimate_tokens(payload)
+        response = self._request_with_retries(
+            self._send_hedged, url, headers, payload, estimated, **kwargs
+        )
+        self._record_usage(self.rate_limiter, response.text, estimated)
+        return response
+
+    def _iter_sse(self, url: str, headers: Dict[str, str], payload: Dict):
+        """
+        发送流式请求并逐条产出 server-sent events 中的 JSON 数据
+        """
+        # 流式请求不做对冲，且只在收到首个字节之前重试
+        response = self._request_with_retries(
+            self._send_once,
+            url,
+            headers,
+            payload,
+            self._estimate_tokens(payload),
+            stream=True,
+        )
+        try:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                # 出错时接口直接返回 JSON 而不是事件流
+                data = line
+                if line.startswith("data:"):
+                    data = line[len("data:") :].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    yield json.loads(data)
+                except ValueError:
+                    continue
+        finally:
+            response.close()
+
+    def _get_async_session(self):
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        entry = self._async_sessions.get(loop)
+        if entry is None or entry[0].closed:
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
+            entry = (
+                aiohttp.ClientSession(connector=connector),
+                asyncio.Semaphore(self.max_concurrency),
+            )
+            self._async_sessions[loop] = entry
+        return entry
+
+    async def _asend_once(self, url, headers, payload, estimated):
+        import aiohttp
+
+        session, slots = self._get_async_session()
+        await self.rate_limiter.aacquire(estimated)
+        timeout = aiohttp.ClientTimeout(total=self.retry_policy.request_timeout())
+        async with slots:
+            start = time.monotonic()
+            async with session.post(
+                url, headers=headers, data=json.dumps(payload), timeout=timeout
+            ) as response:
+                status = response.status
+                response_headers = response.headers.copy()
+                text = await response.text()
+        self.latency.record(time.monotonic() - start)
+        self.rate_limiter.update_from_headers(response_headers, status)
+        return status, response_headers, text
+
+    async def _asend_hedged(self, *args):
+        first = asyncio.ensure_future(self._asend_once(*args))
+        delay = self._hedge_delay()
+        if delay is None:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        # 第一个请求迟迟未返回，发出对冲请求，取先成功的结果并取消另一个
+        pending = {first, asyncio.ensure_future(self._asend_once(*args))}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    async def _apost(
+        self, url: str, headers: Dict[str, str], payload: Dict
+    ) -> Tuple[int, Dict[str, str], str]:
+        """
+        异步 POST 请求，重试规则与同步请求相同
+        :return: (状态码, 响应头, 响应正文)
+        """
+        import aiohttp
+
+        policy = self.retry_policy
+        estimated = self._estimate_tokens(payload)
+        attempt = 0
+        rate_limited = 0
+        while True:
+            check_deadline()
+            try:
+                status, response_headers, text = await self._asend_hedged(
+                    url, headers, payload, estimated
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= policy.max_retries:
+                    raise
+                print(f"警告:请求失败，准备重试: {e}")
+            else:
+                if status == 429 and rate_limited < self.max_rate_limit_retries:
+                    print("警告:请求速率超过限制!")
+                    rate_limited += 1
+                    continue
+                if status < 500 or attempt >= policy.max_retries:
+                    break
+                print(f"警告:服务端错误 {status}，准备重试")
+            await asyncio.sleep(policy.backoff(attempt))
+            attempt += 1
+        self._record_usage(self.rate_limiter, text, estimated)
+        return status, response_headers, text
+
+    async def aclose(self):
+        """
+        关闭当前事件循环上的异步会话
+        """
+        entry = self._async_sessions.pop(asyncio.get_running_loop(), None)
+        if entry is not None:
+            await entry[0].close()
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
@@ -0,0 +1,189 @@
+# LLM/cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .llm import LLM
+
+
+class CacheMiss(LookupError):
+    pass
+
+
+class ResponseCache:
+    """
+    以内容哈希为键、存储在 SQLite 中的 LLM 响应缓存，超过容量时按最近使用时间淘汰
+    """
+
+    def __init__(self, path="llm_cache.sqlite", max_bytes=1024 * 1024 * 1024):
+        """
+        :param path: SQLite 文件路径
+        :param max_bytes: 缓存响应的总字节数上限
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)"
+        )
+        self._conn.commit()
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    @staticmethod
+    def make_key(model, instruction, prompt, params):
+        raw = json.dumps(
+            [model, instruction, prompt, params],
+            ensure_ascii=False,
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, response):
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                (key, response, size, time.time()),
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # 淘汰到容量的 90%，避免每次写入都触发淘汰
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute(
+            "SELECT key, size FROM responses ORDER BY last_used ASC"
+        )
+        evicted = []
+        for key, size in rows:
+            if self._total_bytes <= target:
+                break
+            evicted.append((key,))
+            self._total_bytes -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedLLM(LLM):
+    """
+    为任意 LLM 加一层响应缓存
+
+    mode:
+        readwrite: 命中则直接返回，未命中时调用模型并写入缓存
+        record: 总是调用模型，并用新结果覆盖缓存
+        replay: 只从缓存读取，未命中时抛出 CacheMiss，不会访问模型
+    """
+
+    modes = ("readwrite", "record", "replay")
+
+    def __init__(self, llm, cache, mode="readwrite"):
+        if mode not in self.modes:
+            raise ValueError(f"Unsupported cache mode: {mode}")
+        self.llm = llm
+        self.cache = cache
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name):
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def _model_id(self):
+        platform = getattr(self.llm, "platform", None)
+        model = getattr(self.llm, "model", None) or getattr(
+            self.llm, "model_path", None
+        )
+        return f"{platform or type(self.llm).__name__}/{model}"
+
+    def _key(self, instruction, prompt, args, kwargs):
+        params = {"args": list(args), "kwargs": kwargs}
+        return self.cache.make_key(self._model_id(), instruction, prompt, params)
+
+    def _lookup(self, key):
+        if self.mode == "record":
+            return None
+        response = self.cache.get(key)
+        if response is not None:
+            self.hits += 1
+            return response
+        self.misses += 1
+        if self.mode == "replay":
+            raise CacheMiss(f"No cached response for key {key}")
+        return None
+
+    def _store(self, key, response):
+        # 空响应通常是接口报错，不缓存
+        if isinstance(response, str) and response:
+            self.cache.put(key, response)
+
+    def generate(self, instruction, prompt, *args, **kwargs):
+        key = self._key(instruction, prompt, args, kwargs)
+        response = self._lookup(key)
+        if response is None:
+            response = self.llm.generate(instruction, prompt, *args, **kwargs)
+            self._store(key, response)
+        return response
+
+    def stream(self, instruction, prompt, *args, **kwargs):
+        key = self._key(instruction, prompt, args, kwargs)
+        response = self._lookup(key)
+        if response is not None:
+            yield response
+            return
+        parts = []
+        for text in self.llm.stream(instruction, prompt, *args, **kwargs):
+            parts.append(text)
+            yield text
+        # 只缓存完整生成的结果；只需要开头的调用方应改用 generate
+        self._store(key, "".join(parts))
+
+    async def agenerate(self, instruction, prompt, *args, **kwargs):
+        key = self._key(instruction, prompt, args, kwargs)
+        response = self._lookup(key)
+        if response is None:
+            response = await self.llm.agenerate(instruction, prompt, *args, **kwargs)
+            self._store(key, response)
+        return response
+
+    async def aclose(self):
+        await self.llm.aclose()
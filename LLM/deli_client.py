@@ -1,15 +1,61 @@
-import requests
 import json
+import threading
 
+from .law_search import CachedLawSearch, LawSearchBackend
+from .resilience import bounded_timeout
 
-def search_law(query):
-    LAW_VECTOR_API_URL = "" # Place your API URL here
-    URL = "" # Place your API URL here
-    params = {"question": query}
-    res = requests.get(URL, params=params)
-    res = json.loads(res.text)
 
-    return res
+class DeliLawSearch(LawSearchBackend):
+    """
+    远程法条检索接口
+    """
+
+    def __init__(self, url="", timeout=30):
+        self.url = url  # Place your API URL here
+        self.timeout = timeout
+
+    def search(self, query, top_k=5):
+        import requests
+
+        params = {"question": query}
+        res = requests.get(
+            self.url, params=params, timeout=bounded_timeout(self.timeout)
+        )
+        res = json.loads(res.text)
+
+        return res[:top_k]
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def set_law_search_backend(backend, cache_size=1024):
+    """
+    设置 search_law 使用的检索后端
+    :param cache_size: 后端前 LRU 缓存的条目数，为 0 时不缓存
+    """
+    global _backend
+    with _backend_lock:
+        _backend = CachedLawSearch(backend, cache_size) if cache_size else backend
+    return _backend
+
+
+def get_law_search_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = CachedLawSearch(DeliLawSearch())
+        return _backend
+
+
+def search_law(query, top_k=5):
+    """
+    :param query: 查询文本；Agent 生成的 {"query": "..."} 形式的 JSON 会取出其中的文本
+    """
+    if isinstance(query, dict):
+        query = query.get("query", query)
+    return get_law_search_backend().search(str(query), top_k)
 
 
 if __name__ == "__main__":
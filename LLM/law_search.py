@@ -0,0 +1,284 @@
+# LLM/law_search.py
+import argparse
+import importlib.util
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
+
+
+LAW_FIELDS = ("lawsName", "articleTag", "articleContent")
+
+_CJK_RUN = re.compile(r"[\u4e00-\u9fff]+")
+_WORD = re.compile(r"[a-zA-Z0-9]+")
+
+
+def default_tokenizer():
+    # 只检查是否安装，真正用到时才导入（导入 jieba 需要数百毫秒）
+    return "jieba" if importlib.util.find_spec("jieba") is not None else "bigram"
+
+
+def tokenize(text, tokenizer=None):
+    """
+    中文分词。tokenizer 为 "jieba" 时使用结巴分词的搜索引擎模式，
+    为 "bigram" 时对连续汉字取单字和相邻两字；英文和数字按词切分
+    """
+    tokenizer = tokenizer or default_tokenizer()
+    if tokenizer == "jieba":
+        import jieba
+
+        return [
+            token.lower()
+            for token in jieba.lcut_for_search(text)
+            if token.strip() and (_CJK_RUN.search(token) or _WORD.search(token))
+        ]
+
+    tokens = [word.lower() for word in _WORD.findall(text)]
+    for run in _CJK_RUN.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i : i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def iter_corpus(path):
+    """
+    逐行读取法条语料（JSONL），每行包含 lawsName、articleTag、articleContent
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                law = json.loads(line)
+            except ValueError:
+                print(f"警告:跳过无法解析的第 {line_number} 行")
+                continue
+            if all(field in law for field in LAW_FIELDS):
+                yield {field: law[field] for field in LAW_FIELDS}
+
+
+class LawSearchBackend(ABC):
+    @abstractmethod
+    def search(self, query, top_k=5):
+        """
+        :return: 法条列表，每条包含 lawsName、articleTag、articleContent
+        """
+        pass
+
+
+class LocalLawIndex(LawSearchBackend):
+    """
+    存储在 SQLite 中的法条倒排索引，按 BM25 打分
+    """
+
+    def __init__(self, path="law_index/laws.sqlite", tokenizer=None, k1=1.5, b=0.75):
+        """
+        :param path: 索引文件路径
+        :param tokenizer: 分词方式，"jieba" 或 "bigram"；为 None 时沿用索引建立时的
+            分词方式，新索引在安装了 jieba 时使用 jieba
+        """
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(
+            "PRAGMA journal_mode=WAL;"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+            "CREATE TABLE IF NOT EXISTS articles ("
+            "id INTEGER PRIMARY KEY, lawsName TEXT, articleTag TEXT, "
+            "articleContent TEXT, length INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS terms ("
+            "term TEXT PRIMARY KEY, df INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS postings ("
+            "term TEXT NOT NULL, article INTEGER NOT NULL, tf INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS postings_term ON postings (term);"
+        )
+        stored = self._meta("tokenizer")
+        if stored is None:
+            stored = tokenizer or default_tokenizer()
+            self._set_meta("tokenizer", stored)
+            self._conn.commit()
+        elif tokenizer is not None and tokenizer != stored:
+            raise ValueError(
+                f"Index {path} was built with tokenizer {stored!r}, not {tokenizer!r}"
+            )
+        self.tokenizer = stored
+        self._load_stats()
+
+    def _meta(self, key):
+        row = self._conn.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key, value):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value))
+        )
+
+    def _load_stats(self):
+        count, total = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM articles"
+        ).fetchone()
+        self._count = count
+        self._avg_length = total / count if count else 0.0
+
+    def __len__(self):
+        return self._count
+
+    def add_laws(self, laws, batch_size=1000):
+        """
+        批量写入法条并更新倒排索引
+        :param laws: 可迭代的法条字典
+        :return: 写入的条数
+        """
+        added = 0
+        batch = []
+        with self._lock:
+            for law in laws:
+                batch.append(law)
+                if len(batch) >= batch_size:
+                    added += self._add_batch(batch)
+                    batch = []
+            if batch:
+                added += self._add_batch(batch)
+            self._conn.commit()
+            self._load_stats()
+        return added
+
+    def _add_batch(self, laws):
+        df = Counter()
+        postings = []
+        for law in laws:
+            counts = Counter(tokenize(self._law_text(law), self.tokenizer))
+            cursor = self._conn.execute(
+                "INSERT INTO articles (lawsName, articleTag, articleContent, length) "
+                "VALUES (?, ?, ?, ?)",
+                (*(law[field] for field in LAW_FIELDS), sum(counts.values())),
+            )
+            article = cursor.lastrowid
+            postings.extend((term, article, tf) for term, tf in counts.items())
+            df.update(counts.keys())
+        self._conn.executemany(
+            "INSERT INTO postings (term, article, tf) VALUES (?, ?, ?)", postings
+        )
+        self._conn.executemany(
+            "INSERT INTO terms (term, df) VALUES (?, ?) "
+            "ON CONFLICT(term) DO UPDATE SET df = df + excluded.df",
+            df.items(),
+        )
+        return len(laws)
+
+    @staticmethod
+    def _law_text(law):
+        return " ".join(law[field] for field in LAW_FIELDS)
+
+    def load_corpus(self, path, batch_size=1000):
+        return self.add_laws(iter_corpus(path), batch_size)
+
+    def search(self, query, top_k=5):
+        terms = Counter(tokenize(query, self.tokenizer))
+        if not terms or not self._count:
+            return []
+        with self._lock:
+            scores = Counter()
+            for term, query_tf in terms.items():
+                row = self._conn.execute(
+                    "SELECT df FROM terms WHERE term = ?", (term,)
+                ).fetchone()
+                if row is None:
+                    continue
+                df = row[0]
+                idf = math.log(1 + (self._count - df + 0.5) / (df + 0.5))
+                rows = self._conn.execute(
+                    "SELECT p.article, p.tf, a.length FROM postings p "
+                    "JOIN articles a ON a.id = p.article WHERE p.term = ?",
+                    (term,),
+                )
+                for article, tf, length in rows:
+                    norm = self.k1 * (
+                        1 - self.b + self.b * length / (self._avg_length or 1)
+                    )
+                    weight = tf * (self.k1 + 1) / (tf + norm)
+                    scores[article] += query_tf * idf * weight
+            if not scores:
+                return []
+            ranked = [article for article, _ in scores.most_common(top_k)]
+            placeholders = ",".join("?" * len(ranked))
+            rows = self._conn.execute(
+                f"SELECT id, lawsName, articleTag, articleContent FROM articles "
+                f"WHERE id IN ({placeholders})",
+                ranked,
+            ).fetchall()
+        by_id = {row[0]: dict(zip(LAW_FIELDS, row[1:])) for row in rows}
+        return [by_id[article] for article in ranked]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedLawSearch(LawSearchBackend):
+    """
+    在任意检索后端前加一层进程内 LRU 缓存
+    """
+
+    def __init__(self, backend, max_size=1024):
+        self.backend = backend
+        self.max_size = max_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def search(self, query, top_k=5):
+        key = (query, top_k)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return [dict(law) for law in self._cache[key]]
+            self.misses += 1
+        laws = self.backend.search(query, top_k)
+        with self._lock:
+            self._cache[key] = [dict(law) for law in laws]
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+        return laws
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the local law index")
+    parser.add_argument("--index", default="law_index/laws.sqlite")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Load a JSONL statute corpus")
+    build.add_argument("corpus")
+    build.add_argument("--tokenizer", choices=["jieba", "bigram"], default=None)
+    query = subparsers.add_parser("query", help="Search the index")
+    query.add_argument("query")
+    query.add_argument("--top-k", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        index = LocalLawIndex(args.index, tokenizer=args.tokenizer)
+        added = index.load_corpus(args.corpus)
+        print(f"已写入 {added} 条法条，索引共 {len(index)} 条")
+    else:
+        index = LocalLawIndex(args.index)
+        for law in index.search(args.query, args.top_k):
+            print(json.dumps(law, ensure_ascii=False))
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
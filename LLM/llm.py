@@ -1,10 +1,27 @@
 # LLM/llm.py:
+import asyncio
 from abc import ABC, abstractmethod
-import requests
-from transformers import AutoModelForCausalLM, AutoTokenizer
 
 
 class LLM(ABC):
     @abstractmethod
     def generate(self, prompt,*args, **kwargs):
         pass
+
+    def stream(self, *args, **kwargs):
+        """
+        逐段产出生成的文本；默认一次性产出 generate 的完整结果
+        """
+        yield self.generate(*args, **kwargs)
+
+    async def agenerate(self, *args, **kwargs):
+        """
+        generate 的协程版本；默认在线程池中执行同步的 generate
+        """
+        return await asyncio.to_thread(self.generate, *args, **kwargs)
+
+    async def aclose(self):
+        """
+        释放当前事件循环上的异步资源
+        """
+        pass
@@ -1,26 +1,271 @@
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+from transformers import (
+    AutoTokenizer,
+    AutoModelForCausalLM,
+    DynamicCache,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
+    pipeline,
+)
 from .llm import LLM
+from .prefix_cache import PrefixKVCache
+from .resilience import DeadlineExceeded, check_deadline, remaining_time
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import torch
 
 
+class _StopOnEvent(StoppingCriteria):
+    """
+    流式生成的调用方提前结束迭代，或超过截止时间时停止生成
+    """
+
+    def __init__(self, event, deadline_at=None):
+        """
+        :param deadline_at: time.monotonic() 时间下的截止时间；生成线程中读不到
+            调用方的 contextvars，所以在启动前算好传入
+        """
+        self.event = event
+        self.deadline_at = deadline_at
+
+    def __call__(self, input_ids, scores, **kwargs):
+        stop = self.event.is_set() or (
+            self.deadline_at is not None and time.monotonic() >= self.deadline_at
+        )
+        return torch.full(
+            (input_ids.shape[0],),
+            stop,
+            dtype=torch.bool,
+            device=input_ids.device,
+        )
+
+
 class OfflineLLM(LLM):
-    def __init__(self, model_path, device="cuda"):
+    def __init__(
+        self,
+        model_path,
+        device="auto",
+        max_batch_size=8,
+        max_wait=0.02,
+        prefix_cache_mb=0,
+    ):
+        """
+        :param device: auto / cuda / cpu；auto 在有 GPU 时使用 cuda，否则使用 cpu
+        :param max_batch_size: 自动合批时单批最多的对话数，为 1 时不合批
+        :param max_wait: 自动合批时等待更多请求的最长时间（秒）
+        :param prefix_cache_mb: 前缀 KV 缓存的容量上限，为 0 时不启用；
+            启用后逐条生成并复用共享前缀，不再自动合批
+        """
+        self.model_path = model_path
+        if device == "auto":
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = device
+        # CPU 上 float16 的矩阵运算支持很差，使用 float32
+        torch_dtype = torch.float32 if device == "cpu" else torch.float16
         self.pipe = pipeline(
             "text-generation",
             model=model_path,
-            torch_dtype=torch.float16,
+            torch_dtype=torch_dtype,
             device_map=device,
         )
+        # 批量生成需要左侧填充
+        tokenizer = self.pipe.tokenizer
+        tokenizer.padding_side = "left"
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
 
-    def generate(self, instruction, prompt, max_new_tokens=500):
+        self.prefix_cache = (
+            PrefixKVCache(int(prefix_cache_mb * 1024 * 1024))
+            if prefix_cache_mb
+            else None
+        )
+        self._model_lock = threading.Lock()
+
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
 
+    @staticmethod
+    def _build_messages(instruction, prompt):
         if instruction is None:
             instruction = "You are a helpful assistant."
 
-        messages = [
+        return [
             {"role": "system", "content": instruction},
             {"role": "user", "content": prompt},
         ]
 
-        response = self.pipe(messages, max_new_tokens=max_new_tokens)
-        return response[0]["generated_text"][-1]["content"]
+    def generate(self, instruction, prompt, max_new_tokens=500):
+        check_deadline()
+        if self.prefix_cache is not None:
+            return self._generate_with_prefix_cache(
+                instruction, prompt, max_new_tokens
+            )
+
+        if self.max_batch_size <= 1:
+            return self.generate_batch([(instruction, prompt)], max_new_tokens)[0]
+
+        # 交给后台线程，与其他 Agent 或案例的并发请求合并成一批
+        future = Future()
+        self._queue.put(((instruction, prompt), max_new_tokens, future))
+        self._ensure_worker()
+        try:
+            return future.result(timeout=remaining_time())
+        except FutureTimeoutError:
+            # 已在批中的请求无法中断，这里只是不再等待它的结果
+            future.cancel()
+            raise DeadlineExceeded("Time budget exhausted waiting for generation")
+
+    def _encode_chat(self, instruction, prompt):
+        return self.pipe.tokenizer.apply_chat_template(
+            self._build_messages(instruction, prompt),
+            add_generation_prompt=True,
+            return_tensors="pt",
+        ).to(self.pipe.model.device)
+
+    def stream(self, instruction, prompt, max_new_tokens=500):
+        check_deadline()
+        remaining = remaining_time()
+        deadline_at = None if remaining is None else time.monotonic() + remaining
+        tokenizer = self.pipe.tokenizer
+        input_ids = self._encode_chat(instruction, prompt)
+        # 设置了时限时，生成线程卡住也不会让调用方无限等待下一段文本
+        streamer = TextIteratorStreamer(
+            tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=remaining
+        )
+        stop = threading.Event()
+        errors = []
+
+        def run():
+            try:
+                # 与前缀缓存和批量生成共用同一个模型，同一时间只允许一个生成
+                with self._model_lock:
+                    self.pipe.model.generate(
+                        input_ids=input_ids,
+                        attention_mask=torch.ones_like(input_ids),
+                        max_new_tokens=max_new_tokens,
+                        streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList(
+                            [_StopOnEvent(stop, deadline_at)]
+                        ),
+                        pad_token_id=tokenizer.pad_token_id,
+                    )
+            except BaseException as e:
+                # 出错时 generate 不会结束 streamer，这里补上结束信号
+                errors.append(e)
+                streamer.end()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        try:
+            for text in streamer:
+                if text:
+                    yield text
+        except queue.Empty:
+            raise DeadlineExceeded("Time budget exhausted waiting for generation")
+        finally:
+            stop.set()
+            thread.join()
+        if errors:
+            raise errors[0]
+        # 因超时被截断的生成不当作完整结果返回
+        check_deadline()
+
+    def generate_batch(self, requests, max_new_tokens=500):
+        """
+        在一次前向计算中生成多个回复
+        :param requests: (instruction, prompt) 列表
+        :return: 与 requests 顺序一致的回复列表
+        """
+        conversations = [
+            self._build_messages(instruction, prompt) for instruction, prompt in requests
+        ]
+        with self._model_lock:
+            responses = self.pipe(
+                conversations,
+                max_new_tokens=max_new_tokens,
+                batch_size=len(conversations),
+            )
+        return [response[0]["generated_text"][-1]["content"] for response in responses]
+
+    def _generate_with_prefix_cache(self, instruction, prompt, max_new_tokens):
+        tokenizer = self.pipe.tokenizer
+        model = self.pipe.model
+        input_ids = self._encode_chat(instruction, prompt)
+        token_ids = input_ids[0].tolist()
+
+        past_key_values, _ = self.prefix_cache.lookup(token_ids)
+        if past_key_values is None:
+            past_key_values = DynamicCache()
+
+        with self._model_lock, torch.no_grad():
+            outputs = model.generate(
+                input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=past_key_values,
+                max_new_tokens=max_new_tokens,
+                return_dict_in_generate=True,
+                pad_token_id=tokenizer.pad_token_id,
+            )
+
+        # 生成后的缓存还包含新生成的 token，裁剪回提示词部分再保存
+        cache = outputs.past_key_values
+        cache.crop(len(token_ids))
+        self.prefix_cache.store(token_ids, cache)
+
+        generated = outputs.sequences[0][len(token_ids) :]
+        return tokenizer.decode(generated, skip_special_tokens=True)
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(
+                        target=self._run, name="offline-llm-batcher", daemon=True
+                    )
+                    self._worker.start()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # 生成长度不同的请求分开批量执行
+            groups = {}
+            for request, max_new_tokens, future in self._next_batch():
+                # 排队期间已因超时被取消的请求不再生成；其余的标记为运行中，之后无法取消
+                if future.set_running_or_notify_cancel():
+                    groups.setdefault(max_new_tokens, []).append((request, future))
+
+            for max_new_tokens, items in groups.items():
+                try:
+                    responses = self.generate_batch(
+                        [request for request, _ in items], max_new_tokens
+                    )
+                except Exception as e:
+                    responses = None
+                    error = e
+                for i, (_, future) in enumerate(items):
+                    # 结果无法写入时也不能让合批线程退出，否则之后的请求会一直等待
+                    try:
+                        if responses is None:
+                            future.set_exception(error)
+                        else:
+                            future.set_result(responses[i])
+                    except InvalidStateError:
+                        pass
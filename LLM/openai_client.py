@@ -1,16 +1,18 @@
 # api_client/openai_client.py
-import requests
 import json
 from .base_client import BaseClient
 
 
 class OpenAIClient(BaseClient):
-    def __init__(self, api_key, model):
+    platform = "openai"
+    url = "https://api.openai.com/v1/chat/completions"
+
+    def __init__(self, api_key, model, max_concurrency=8):
+        super().__init__(max_concurrency)
         self.api_key = api_key
         self.model = model
 
-    def send_request(self, messages):
-        url = "https://api.openai.com/v1/chat/completions"
+    def _build_request(self, messages):
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {self.api_key}",
@@ -19,6 +21,28 @@ class OpenAIClient(BaseClient):
             "model": self.model,
             "messages": messages,
         }
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
-        text = json.loads(response.text)
+        return headers, payload
+
+    @staticmethod
+    def _parse_response(text):
+        text = json.loads(text)
         return text.get("choices")[0].get("message").get("content")
+
+    def send_request(self, messages):
+        headers, payload = self._build_request(messages)
+        response = self._post(self.url, headers, payload)
+        return self._parse_response(response.text)
+
+    async def asend_request(self, messages):
+        headers, payload = self._build_request(messages)
+        _, _, text = await self._apost(self.url, headers, payload)
+        return self._parse_response(text)
+
+    def stream_request(self, messages):
+        headers, payload = self._build_request(messages)
+        payload["stream"] = True
+        for chunk in self._iter_sse(self.url, headers, payload):
+            choices = chunk.get("choices") or [{}]
+            text = choices[0].get("delta", {}).get("content")
+            if text:
+                yield text
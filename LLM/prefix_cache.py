@@ -0,0 +1,97 @@
+# LLM/prefix_cache.py
+import threading
+from collections import OrderedDict
+
+
+def _common_prefix_length(a, b):
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class PrefixKVCache:
+    """
+    按 token 前缀保存 past key/values 的 LRU 缓存，占用的显存/内存不超过 max_bytes
+
+    同一 Agent 的连续调用共享「角色指令 + 法庭记录」这样的长前缀，命中后只需
+    对新增的后缀做 prefill。
+    """
+
+    def __init__(self, max_bytes, min_prefix_tokens=64, min_prefix_ratio=0.25):
+        """
+        :param min_prefix_tokens: 公共前缀少于该 token 数时不算命中；所有提示词都
+            共享的对话模板开头复用价值很小，不值得复制缓存
+        :param min_prefix_ratio: 公共前缀至少占提示词的比例
+        """
+        self.max_bytes = max_bytes
+        self.min_prefix_tokens = min_prefix_tokens
+        self.min_prefix_ratio = min_prefix_ratio
+        self._entries = OrderedDict()  # token 前缀 -> (DynamicCache, 字节数)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _nbytes(cache):
+        return sum(
+            tensor.numel() * tensor.element_size()
+            for tensor in list(cache.key_cache) + list(cache.value_cache)
+        )
+
+    def lookup(self, input_ids):
+        """
+        查找与 input_ids 公共前缀最长的缓存
+        :param input_ids: token id 列表
+        :return: (只包含公共前缀的缓存副本, 前缀长度)；未命中时为 (None, 0)
+        """
+        min_length = max(
+            self.min_prefix_tokens, int(len(input_ids) * self.min_prefix_ratio)
+        )
+        with self._lock:
+            best_key, best_length = None, 0
+            for key in self._entries:
+                # 至少留一个 token 不走缓存，模型才能输出下一个 token 的 logits
+                length = min(_common_prefix_length(key, input_ids), len(input_ids) - 1)
+                if length > best_length:
+                    best_key, best_length = key, length
+            if best_key is None or best_length < min_length:
+                self.misses += 1
+                return None, 0
+            self.hits += 1
+            self._entries.move_to_end(best_key)
+            cached = self._entries[best_key][0]
+        # 只复制前缀部分，缓存中的张量不会被原地修改，可以在锁外读取
+        return self._copy_prefix(cached, best_length), best_length
+
+    @staticmethod
+    def _copy_prefix(cache, length):
+        """
+        :return: 只包含前 length 个 token 的新缓存，张量形状为 (batch, heads, seq, dim)
+        """
+        return type(cache).from_legacy_cache(
+            tuple(
+                (key[..., :length, :].clone(), value[..., :length, :].clone())
+                for key, value in zip(cache.key_cache, cache.value_cache)
+            )
+        )
+
+    def store(self, input_ids, cache):
+        """
+        :param input_ids: cache 对应的 token id 列表
+        :param cache: 恰好覆盖 input_ids 的 DynamicCache，此后归缓存所有
+        """
+        key = tuple(input_ids)
+        nbytes = self._nbytes(cache)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (cache, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self._bytes -= evicted_bytes
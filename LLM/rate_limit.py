@@ -0,0 +1,193 @@
+# LLM/rate_limit.py
+import asyncio
+import re
+import threading
+import time
+
+from .resilience import DeadlineExceeded, remaining_time
+
+
+def _parse_duration(value):
+    """
+    解析限流响应头中的时间，支持 "30"、"1.5s"、"20ms"、"6m0s" 等形式，单位为秒
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    parts = re.findall(r"([\d.]+)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+def _header(headers, name):
+    # requests 与 aiohttp 的响应头都不区分大小写，这里兼容普通 dict
+    value = headers.get(name)
+    if value is None:
+        value = headers.get(name.lower())
+    return value
+
+
+def _number_header(headers, name):
+    try:
+        return float(_header(headers, name))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    同时限制每分钟请求数和每分钟 token 数的令牌桶，并根据服务端返回的
+    X-Ratelimit-* 响应头校正剩余额度
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = requests_per_minute
+        self._tokens = tokens_per_minute
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(
+                self.requests_per_minute,
+                self._requests + elapsed * self.requests_per_minute / 60,
+            )
+        if self.tokens_per_minute:
+            self._tokens = min(
+                self.tokens_per_minute,
+                self._tokens + elapsed * self.tokens_per_minute / 60,
+            )
+
+    def reserve(self, tokens=0):
+        """
+        预占一次请求和 tokens 个 token 的额度
+        :return: 调用方在发出请求前需要等待的秒数
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(self._blocked_until - now, 0.0)
+            if self.requests_per_minute:
+                self._requests -= 1
+                if self._requests < 0:
+                    wait = max(wait, -self._requests * 60 / self.requests_per_minute)
+            if self.tokens_per_minute and tokens:
+                self._tokens -= tokens
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens * 60 / self.tokens_per_minute)
+            return wait
+
+    def release(self, tokens=0):
+        """
+        归还 reserve 预占但最终没有使用的额度
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.requests_per_minute:
+                self._requests = min(self.requests_per_minute, self._requests + 1)
+            if self.tokens_per_minute and tokens:
+                self._tokens = min(self.tokens_per_minute, self._tokens + tokens)
+
+    def _reserve_within_deadline(self, tokens):
+        wait = self.reserve(tokens)
+        remaining = remaining_time()
+        if remaining is not None and wait >= remaining:
+            # 额度恢复前就会超出时限，不再等待，归还额度后立即放弃
+            self.release(tokens)
+            raise DeadlineExceeded("Time budget exhausted waiting for rate limit")
+        return wait
+
+    def acquire(self, tokens=0):
+        wait = self._reserve_within_deadline(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def aacquire(self, tokens=0):
+        wait = self._reserve_within_deadline(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def consume(self, tokens):
+        """
+        根据实际用量修正预占的 token 数，tokens 可以为负
+        """
+        if not self.tokens_per_minute or not tokens:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self.tokens_per_minute, self._tokens - tokens)
+
+    def update_from_headers(self, headers, status_code=200):
+        """
+        用服务端的剩余额度校正令牌桶；额度耗尽或返回 429 时暂停到额度恢复
+        """
+        limit_requests = _number_header(headers, "X-Ratelimit-Limit-Requests")
+        limit_tokens = _number_header(headers, "X-Ratelimit-Limit-Tokens")
+        remaining_requests = _number_header(headers, "X-Ratelimit-Remaining-Requests")
+        remaining_tokens = _number_header(headers, "X-Ratelimit-Remaining-Tokens")
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            # 未配置限额时采用服务端告知的限额
+            if limit_requests and not self.requests_per_minute:
+                self.requests_per_minute = self._requests = limit_requests
+            if limit_tokens and not self.tokens_per_minute:
+                self.tokens_per_minute = self._tokens = limit_tokens
+            if remaining_requests is not None and self.requests_per_minute:
+                self._requests = min(self._requests, remaining_requests)
+            if remaining_tokens is not None and self.tokens_per_minute:
+                self._tokens = min(self._tokens, remaining_tokens)
+
+            exhausted = status_code == 429
+            for remaining in (remaining_requests, remaining_tokens):
+                if remaining is not None and remaining <= 0:
+                    exhausted = True
+            if exhausted:
+                delay = (
+                    _parse_duration(_header(headers, "Retry-After"))
+                    or _parse_duration(_header(headers, "X-Ratelimit-Reset-Requests"))
+                    or _parse_duration(_header(headers, "X-Ratelimit-Reset-Tokens"))
+                    or 60.0
+                )
+                self._blocked_until = max(self._blocked_until, now + delay)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(platform, model):
+    """
+    进程内按 (平台, 模型) 共享的限流器
+    """
+    key = (platform, model)
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = RateLimiter()
+        return _limiters[key]
+
+
+def configure_rate_limit(
+    platform, model, requests_per_minute=None, tokens_per_minute=None
+):
+    """
+    设置 (平台, 模型) 的限额；未设置时只依据服务端响应头限流
+    """
+    limiter = get_rate_limiter(platform, model)
+    with limiter._lock:
+        if requests_per_minute:
+            limiter.requests_per_minute = limiter._requests = requests_per_minute
+        if tokens_per_minute:
+            limiter.tokens_per_minute = limiter._tokens = tokens_per_minute
+    return limiter
@@ -0,0 +1,119 @@
+# LLM/resilience.py
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+# 当前调用链的截止时间（time.monotonic()），由 deadline() 设置
+_deadline = contextvars.ContextVar("llm_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds):
+    """
+    在 with 块内为所有 LLM 和检索调用设置总时限；嵌套时取更早的截止时间
+    :param seconds: 时限（秒），为 None 时不限制
+    """
+    if seconds is None:
+        yield
+        return
+    current = _deadline.get()
+    new_deadline = time.monotonic() + seconds
+    if current is not None:
+        new_deadline = min(current, new_deadline)
+    token = _deadline.set(new_deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time():
+    """
+    :return: 距截止时间的秒数；未设置截止时间时返回 None
+    """
+    current = _deadline.get()
+    if current is None:
+        return None
+    return current - time.monotonic()
+
+
+def check_deadline():
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded("Time budget exhausted")
+
+
+def bounded_timeout(timeout):
+    """
+    单次请求的超时时间，不超过剩余的总时限
+    """
+    remaining = remaining_time()
+    if remaining is None:
+        return timeout
+    if remaining <= 0:
+        raise DeadlineExceeded("Time budget exhausted")
+    return remaining if timeout is None else min(timeout, remaining)
+
+
+class RetryPolicy:
+    """
+    单次请求超时与瞬时错误的有限次重试，重试间隔为带随机抖动的指数退避
+    """
+
+    def __init__(self, timeout=60.0, max_retries=3, base_delay=1.0, max_delay=30.0):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def request_timeout(self):
+        return bounded_timeout(self.timeout)
+
+    def backoff(self, attempt):
+        """
+        第 attempt 次重试前的等待时间（full jitter），不超过剩余的总时限
+        """
+        cap = min(self.max_delay, self.base_delay * 2**attempt)
+        delay = random.uniform(0, cap)
+        remaining = remaining_time()
+        if remaining is not None:
+            if remaining <= delay:
+                raise DeadlineExceeded("Time budget exhausted while backing off")
+        return delay
+
+
+class LatencyTracker:
+    """
+    记录最近若干次请求的耗时，用于计算对冲请求的触发时间
+    """
+
+    def __init__(self, window=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q):
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+
+def run_in_context(executor, fn, *args, **kwargs):
+    """
+    在线程池中执行 fn，并把当前的截止时间等上下文带过去
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
@@ -0,0 +1,84 @@
+# LLM/traced.py
+import time
+
+import tracing
+from history import estimate_tokens
+
+from .llm import LLM
+
+
+class TracedLLM(LLM):
+    """
+    为任意 LLM 记录调用次数、耗时以及提示词和生成内容的字符数、估计 token 数。
+    只在开启追踪时包裹，关闭时没有任何额外开销。
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    def __getattr__(self, name):
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def _record(self, method, instruction, prompt, response, start, error=False):
+        labels = {"method": method}
+        tracing.inc("court_llm_calls_total", **labels)
+        if error:
+            tracing.inc("court_llm_errors_total", **labels)
+        tracing.observe(
+            "court_llm_latency_seconds", time.perf_counter() - start, **labels
+        )
+        prompt_text = (instruction or "") + prompt
+        tracing.inc("court_llm_prompt_chars_total", len(prompt_text), **labels)
+        tracing.inc(
+            "court_llm_prompt_tokens_total", estimate_tokens(prompt_text), **labels
+        )
+        if response:
+            tracing.inc("court_llm_completion_chars_total", len(response), **labels)
+            tracing.inc(
+                "court_llm_completion_tokens_total", estimate_tokens(response), **labels
+            )
+
+    def generate(self, instruction, prompt, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            with tracing.span("llm.generate"):
+                response = self.llm.generate(instruction, prompt, *args, **kwargs)
+        except Exception:
+            self._record("generate", instruction, prompt, None, start, error=True)
+            raise
+        self._record("generate", instruction, prompt, response, start)
+        return response
+
+    def stream(self, instruction, prompt, *args, **kwargs):
+        start = time.perf_counter()
+        parts = []
+        error = False
+        try:
+            for text in self.llm.stream(instruction, prompt, *args, **kwargs):
+                if not parts:
+                    tracing.observe(
+                        "court_llm_first_token_seconds", time.perf_counter() - start
+                    )
+                parts.append(text)
+                yield text
+        except Exception:
+            error = True
+            raise
+        finally:
+            # 调用方提前结束读取时同样记录已生成的部分
+            self._record("stream", instruction, prompt, "".join(parts), start, error)
+
+    async def agenerate(self, instruction, prompt, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await self.llm.agenerate(instruction, prompt, *args, **kwargs)
+        except Exception:
+            self._record("agenerate", instruction, prompt, None, start, error=True)
+            raise
+        self._record("agenerate", instruction, prompt, response, start)
+        return response
+
+    async def aclose(self):
+        await self.llm.aclose()
@@ -1,23 +1,126 @@
 # api_client/wenxin_client.py
-import requests
+import asyncio
 import json
+import threading
 from .base_client import BaseClient
 import time
 
 
 class WenxinClient(BaseClient):
-    def __init__(self, api_key, api_secret, model):
+    platform = "wenxin"
+    # 在令牌过期前预留的刷新余量（秒）
+    token_refresh_margin = 300
+
+    def __init__(self, api_key, api_secret, model, max_concurrency=8):
+        super().__init__(max_concurrency)
         self.api_key = api_key
         self.api_secret = api_secret
         self.model = model
+        self._access_token = None
+        self._token_expires_at = 0.0
+        self._token_lock = threading.Lock()
+        self._refresh_timer = None
 
-    def get_access_token(self):
+    def _fetch_access_token(self):
         url = f"https://aip.baidubce.com/oauth/2.0/token?grant_type=client_credentials&client_id={self.api_key}&client_secret={self.api_secret}"
         headers = {"Content-Type": "application/json", "Accept": "application/json"}
-        response = requests.post(url, headers=headers)
-        return response.json().get("access_token")
+        response = self.session.post(
+            url, headers=headers, timeout=self.retry_policy.request_timeout()
+        )
+        return response.json()
+
+    def _token_valid(self):
+        return (
+            self._access_token is not None
+            and time.monotonic() < self._token_expires_at - self.token_refresh_margin
+        )
+
+    def refresh_access_token(self):
+        """
+        重新获取访问令牌并安排下一次后台刷新
+        """
+        with self._token_lock:
+            return self._refresh_locked()
+
+    def _refresh_locked(self):
+        data = self._fetch_access_token()
+        access_token = data.get("access_token")
+        if access_token is None:
+            print(f"警告:获取access_token失败: {data}")
+            return self._access_token
+        expires_in = float(data.get("expires_in", 0))
+        self._access_token = access_token
+        self._token_expires_at = time.monotonic() + expires_in
+        # 后台刷新早于缓存失效，正常情况下请求线程不会遇到同步刷新
+        self._schedule_refresh(expires_in - 2 * self.token_refresh_margin)
+        return access_token
+
+    def invalidate_access_token(self, access_token):
+        """
+        服务端判定令牌失效时丢弃缓存；若其他线程已换新令牌则不做处理
+        """
+        with self._token_lock:
+            if self._access_token == access_token:
+                self._token_expires_at = 0.0
+
+    def _schedule_refresh(self, delay):
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+        if delay <= 0:
+            self._refresh_timer = None
+            return
+        self._refresh_timer = threading.Timer(delay, self._background_refresh)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh_access_token()
+        except Exception as e:
+            # 后台刷新失败时，由下一次请求同步刷新
+            print(f"警告:后台刷新access_token失败: {e}")
+
+    def get_access_token(self):
+        """
+        返回缓存的访问令牌，仅在令牌缺失或即将过期时才请求新的令牌
+        """
+        if self._token_valid():
+            return self._access_token
+        with self._token_lock:
+            # 等待锁期间其他线程可能已完成刷新
+            if self._token_valid():
+                return self._access_token
+            return self._refresh_locked()
+
+    async def _aget_access_token(self):
+        if self._token_valid():
+            return self._access_token
+        # 刷新会阻塞，放到线程中执行以免卡住事件循环
+        return await asyncio.to_thread(self.get_access_token)
+
+    @staticmethod
+    def _token_rejected(text):
+        """
+        110/111 表示 access_token 无效或已过期
+        """
+        try:
+            return json.loads(text).get("error_code") in (110, 111)
+        except (ValueError, AttributeError):
+            return False
+
+    def _chat_url(self, access_token):
+        if self.model == "ERNIE-4.0-8K":
+            endpoint = "completions_pro"
+        elif self.model == "ERNIE-Speed-128K":
+            endpoint = "ernie-speed-128k"
+        elif self.model == "ERNIE-3.5-8K":
+            endpoint = "completions"
+        else:
+            raise ValueError("Invalid model name")
+
+        return f"https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/{endpoint}?access_token={access_token}"
 
-    def send_request(
+    def _build_payload(
         self,
         messages,
         temperature=0.8,
@@ -37,20 +140,6 @@ class WenxinClient(BaseClient):
         *args,
         **kwargs,
     ):
-
-        access_token = self.get_access_token()
-        if self.model == "ERNIE-4.0-8K":
-            endpoint = "completions_pro"
-        elif self.model == "ERNIE-Speed-128K":
-            endpoint = "ernie-speed-128k"
-        elif self.model == "ERNIE-3.5-8K":
-            endpoint = "completions"
-        else:
-            raise ValueError("Invalid model name")
-
-        base_url = f"https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/{endpoint}?access_token={access_token}"
-        headers = {"Content-Type": "application/json"}
-
         system_messages = [msg for msg in messages if msg["role"] == "system"]
         if system_messages:
             system = system_messages[0]["content"]
@@ -84,40 +173,11 @@ class WenxinClient(BaseClient):
         if tool_choice:
             payload["tool_choice"] = tool_choice
 
-        response = requests.post(base_url, headers=headers, data=json.dumps(payload))
+        return payload
 
-        # 处理速率限制
-        if response.status_code == 429:
-            print("警告:请求速率超过限制!")
-            remaining_requests = int(
-                response.headers.get("X-Ratelimit-Remaining-Requests", 0)
-            )
-            remaining_tokens = int(
-                response.headers.get("X-Ratelimit-Remaining-Tokens", 0)
-            )
-            if remaining_requests == 0 or remaining_tokens == 0:
-                sleep_time = 60  # 休眠60秒再重试
-                print(f"配额已用尽,{sleep_time}秒后重试...")
-                time.sleep(sleep_time)
-                return self.send_request(
-                    messages,
-                    temperature,
-                    top_p,
-                    penalty_score,
-                    stream,
-                    enable_system_memory,
-                    system_memory_id,
-                    stop,
-                    disable_search,
-                    enable_citation,
-                    enable_trace,
-                    max_output_tokens,
-                    response_format,
-                    user_id,
-                    tool_choice,
-                )
-
-        text = json.loads(response.text)
+    @staticmethod
+    def _parse_response(text):
+        text = json.loads(text)
         print(text)
 
         if "result" not in text:
@@ -134,3 +194,49 @@ class WenxinClient(BaseClient):
             print(text["function_call"])
 
         return result
+
+    def send_request(self, messages, *args, **kwargs):
+        payload = self._build_payload(messages, *args, **kwargs)
+        access_token = self.get_access_token()
+        url = self._chat_url(access_token)
+        headers = {"Content-Type": "application/json"}
+
+        response = self._post(url, headers, payload)
+
+        if self._token_rejected(response.text):
+            self.invalidate_access_token(access_token)
+            response = self._post(
+                self._chat_url(self.get_access_token()), headers, payload
+            )
+
+        return self._parse_response(response.text)
+
+    async def asend_request(self, messages, *args, **kwargs):
+        payload = self._build_payload(messages, *args, **kwargs)
+        access_token = await self._aget_access_token()
+        url = self._chat_url(access_token)
+        headers = {"Content-Type": "application/json"}
+
+        _, _, text = await self._apost(url, headers, payload)
+
+        if self._token_rejected(text):
+            self.invalidate_access_token(access_token)
+            url = self._chat_url(await self._aget_access_token())
+            _, _, text = await self._apost(url, headers, payload)
+
+        return self._parse_response(text)
+
+    def stream_request(self, messages, *args, **kwargs):
+        kwargs["stream"] = True
+        payload = self._build_payload(messages, *args, **kwargs)
+        access_token = self.get_access_token()
+        url = self._chat_url(access_token)
+        headers = {"Content-Type": "application/json"}
+        for chunk in self._iter_sse(url, headers, payload):
+            if "error_code" in chunk:
+                print(f"警告:流式请求出错: {chunk}")
+                if chunk.get("error_code") in (110, 111):
+                    self.invalidate_access_token(access_token)
+                return
+            if chunk.get("result"):
+                yield chunk["result"]
@@ -1,16 +1,19 @@
 # api_client/zhipuai_client.py
-import requests
 import json
 from .base_client import BaseClient
 from typing import List, Dict, Optional, Union
 
 
 class ZhipuAIClient(BaseClient):
-    def __init__(self, api_key: str, model: str):
+    platform = "zhipuai"
+    url = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
+
+    def __init__(self, api_key: str, model: str, max_concurrency: int = 8):
+        super().__init__(max_concurrency)
         self.api_key = api_key
         self.model = model
 
-    def send_request(
+    def _build_request(
         self,
         messages: List[Dict[str, str]],
         request_id: Optional[str] = None,
@@ -25,8 +28,7 @@ class ZhipuAIClient(BaseClient):
         user_id: Optional[str] = None,
         *args,
         **kwargs,
-    ) -> str:
-        url = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
+    ):
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
@@ -77,6 +79,30 @@ class ZhipuAIClient(BaseClient):
             user_id, str
         ), "user_id must be a string or None"
 
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
-        text = json.loads(response.text)
+        return headers, payload
+
+    @staticmethod
+    def _parse_response(text: str) -> str:
+        text = json.loads(text)
         return text.get("choices")[0].get("message").get("content")
+
+    def send_request(self, messages: List[Dict[str, str]], *args, **kwargs) -> str:
+        headers, payload = self._build_request(messages, *args, **kwargs)
+        response = self._post(self.url, headers, payload)
+        return self._parse_response(response.text)
+
+    async def asend_request(
+        self, messages: List[Dict[str, str]], *args, **kwargs
+    ) -> str:
+        headers, payload = self._build_request(messages, *args, **kwargs)
+        _, _, text = await self._apost(self.url, headers, payload)
+        return self._parse_response(text)
+
+    def stream_request(self, messages: List[Dict[str, str]], *args, **kwargs):
+        kwargs["stream"] = True
+        headers, payload = self._build_request(messages, *args, **kwargs)
+        for chunk in self._iter_sse(self.url, headers, payload):
+            choices = chunk.get("choices") or [{}]
+            text = choices[0].get("delta", {}).get("content")
+            if text:
+                yield text
@@ -1,9 +1,13 @@
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, Callable
 import re
 import json
+from EMDB.db import content_id
 from LLM.deli_client import search_law
-import uuid
+from LLM.resilience import run_in_context
+from history import CourtHistory, format_entry
+from tracing import traced
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 
 class Agent:
@@ -32,6 +36,7 @@ class Agent:
 
     # --- Plan Phase --- #
 
+    @traced("agent.plan")
     def plan(self, history_list: List[Dict[str, Any]]) -> Dict[str, Any]:
         if self.log_think:
             self.logger.info(f"Agent ({self.role}) starting planning phase")
@@ -43,8 +48,45 @@ class Agent:
         if self.log_think:
             self.logger.info(f"Agent ({self.role}) prepared queries: {queries}")
 
-        return {"plans": plans, "queries": queries}
+        # 记录制定计划时的历史长度，供预先规划的计划判断是否过期
+        return {"plans": plans, "queries": queries, "history_len": len(history_list)}
 
+    @traced("agent.plan_ahead")
+    def plan_ahead(self, history_list: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        在轮到自己发言之前完成规划和检索
+        """
+        plan = self.plan(history_list)
+        plan["contexts"] = self.retrieve(plan["queries"])
+        return plan
+
+    @traced("agent.revalidate_plan")
+    def revalidate_plan(
+        self, plan: Dict[str, Any], history_list: List[Dict[str, Any]]
+    ) -> bool:
+        """
+        判断预先制定的计划在看到之后的新发言后是否仍然适用，只需一次简短的判断
+        :return: True 表示可以直接复用，False 表示需要重新规划
+        """
+        new_entries = history_list[plan["history_len"] :]
+        if not new_entries:
+            return True
+        instruction = f"You are a {self.role}. {self.description}\n\n"
+        prompt = (
+            "You planned which databases to consult and which retrieval queries to run "
+            "before the latest court statements were made.\n\n"
+            f"Plan: {json.dumps(plan['plans'], ensure_ascii=False)}\n"
+            f"Queries: {json.dumps(plan['queries'], ensure_ascii=False)}\n\n"
+            "Latest statements:\n\n"
+            + "\n\n".join(format_entry(entry) for entry in new_entries)
+            + "\n\nDo the latest statements raise new issues that this plan and these "
+            "queries do not cover? Provide only a simple 'true' or 'false' answer."
+        )
+        response = self.llm.generate(instruction=instruction, prompt=prompt)
+        # 无法判断时保守地重新规划
+        return self._parse_boolean(response) is False
+
+    @traced("agent.get_plan")
     def _get_plan(self, history_context: str) -> Dict[str, bool]:
         instruction = f"You are a {self.role}. {self.description}\n\n"
         prompt = "Based on the court history, analyze whether information from the experience, case, or legal database is needed. Return a JSON string with three key-value pairs for experience, case, and legal, with values being true or false."
@@ -65,6 +107,7 @@ class Agent:
             queries["legal"] = self._prepare_legal_query(history_context)
         return queries
 
+    @traced("agent.prepare_experience_query")
     def _prepare_experience_query(self, history_context: str) -> str:
         instruction = f"You are a {self.role}. {self.description}\n\n"
         prompt = """
@@ -81,6 +124,7 @@ class Agent:
         )
         return self.extract_response(response)
 
+    @traced("agent.prepare_case_query")
     def _prepare_case_query(self, history_context: str) -> str:
         instruction = f"You are a {self.role}. {self.description}\n\n"
         prompt = """
@@ -97,6 +141,7 @@ class Agent:
         )
         return self.extract_response(response)
 
+    @traced("agent.prepare_legal_query")
     def _prepare_legal_query(self, history_context: str) -> str:
         instruction = f"You are a {self.role}. {self.description}\n\n"
         prompt = """
@@ -115,41 +160,55 @@ class Agent:
 
     # --- Do Phase --- #
 
+    @traced("agent.execute")
     def execute(
-        self, plan: Dict[str, Any], history_list: List[Dict[str, str]], prompt: str
+        self,
+        plan: Dict[str, Any],
+        history_list: List[Dict[str, str]],
+        prompt: str,
+        on_token: Callable[[str], None] = None,
     ) -> str:
         if not plan:
             context = self.prepare_history_context(history_list)
         else:
             context = self._prepare_context(plan, history_list)
-        return self.speak(context, prompt)
+        return self.speak(context, prompt, on_token=on_token)
 
-    def speak(self, context: str, prompt: str) -> str:
+    def speak(
+        self, context: str, prompt: str, on_token: Callable[[str], None] = None
+    ) -> str:
+        """
+        :param on_token: 若给出则流式生成，每生成一段文本回调一次
+        """
         instruction = f"You are a {self.role}. {self.description}\n\n"
         full_prompt = f"{context}\n\n{prompt}"
-        return self.llm.generate(instruction=instruction, prompt=full_prompt)
+        if on_token is None:
+            return self.llm.generate(instruction=instruction, prompt=full_prompt)
+
+        parts = []
+        for text in self.llm.stream(instruction=instruction, prompt=full_prompt):
+            parts.append(text)
+            on_token(text)
+        return "".join(parts)
 
     def _prepare_context(
         self, plan: Dict[str, Any], history_list: List[Dict[str, str]]
     ) -> str:
         context = ""
-        queries = plan["queries"]
+        contexts = plan.get("contexts")
+        if contexts is None:
+            contexts = self.retrieve(plan["queries"])
 
-        if "experience" in queries:
-            experience_context = self.db.query_experience_metadatas(
-                queries["experience"], n_results=3
-            )
+        if "experience" in contexts:
             context += (
-                f"\n遵循下面的经验，以增强回复的逻辑严密性:\n{experience_context}\n"
+                f"\n遵循下面的经验，以增强回复的逻辑严密性:\n{contexts['experience']}\n"
             )
 
-        if "case" in queries:
-            case_context = self.db.query_case_metadatas(queries["case"], n_results=3)
-            context += f"\nCase Context:\n{case_context}\n"
+        if "case" in contexts:
+            context += f"\nCase Context:\n{contexts['case']}\n"
 
-        if "legal" in queries:
-            legal_context = self.db.query_legal(queries["legal"], n_results=3)
-            context += f"\nLaw Context:\n{legal_context}\n"
+        if "legal" in contexts:
+            context += f"\nLaw Context:\n{contexts['legal']}\n"
 
         if self.log_think:
             self.logger.info(f"Agent ({self.role})\n\n{context}")
@@ -159,29 +218,43 @@ class Agent:
 
         return context
 
+    @traced("agent.retrieve")
+    def retrieve(self, queries: Dict[str, str]) -> Dict[str, str]:
+        return self.db.query_all(queries, n_results=3)
+
     # --- Reflect Phase --- #
 
+    @traced("agent.reflect")
     def reflect(self, history_list: List[Dict[str, str]]):
 
         history_context = self.prepare_history_context(history_list)
 
-        case_content = self.prepare_case_content(history_context)
+        # 三类反思互不依赖，并发执行；经验和案例反思需要先得到案件总结
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            # Legal knowledge base reflection
+            legal_future = run_in_context(
+                executor, self._reflect_on_legal_knowledge, history_context
+            )
 
-        # Legal knowledge base reflection
-        legal_reflection = self._reflect_on_legal_knowledge(history_context)
-        if self.log_think:
-            self.logger.info(f"Agent ({self.role})\n\n{legal_reflection}")
+            case_content = self.prepare_case_content(history_context)
 
-        # Experience reflection
-        experience_reflection = self._reflect_on_experience(
-            case_content, history_context
-        )
-        if self.log_think:
-            self.logger.info(f"Agent ({self.role})\n\n{experience_reflection}")
+            # Experience reflection
+            experience_future = run_in_context(
+                executor, self._reflect_on_experience, case_content, history_context
+            )
+
+            # Case reflection
+            case_future = run_in_context(
+                executor, self._reflect_on_case, case_content, history_context
+            )
+
+            legal_reflection = legal_future.result()
+            experience_reflection = experience_future.result()
+            case_reflection = case_future.result()
 
-        # Case reflection
-        case_reflection = self._reflect_on_case(case_content, history_context)
         if self.log_think:
+            self.logger.info(f"Agent ({self.role})\n\n{legal_reflection}")
+            self.logger.info(f"Agent ({self.role})\n\n{experience_reflection}")
             self.logger.info(f"Agent ({self.role})\n\n{case_reflection}")
 
         return {
@@ -190,6 +263,7 @@ class Agent:
             "case_reflection": case_reflection,
         }
 
+    @traced("agent.reflect_on_legal_knowledge")
     def _reflect_on_legal_knowledge(self, history_context: str) -> Dict[str, Any]:
         # Determine if legal reference is needed
         need_legal = self._need_legal_reference(history_context)
@@ -200,8 +274,9 @@ class Agent:
 
             processed_laws = []
             for law in laws[:3]:  # Limit to 3 laws
-                law_id = str(uuid.uuid4())
                 processed_law = self._process_law(law)
+                # 以内容哈希为 ID，同一法条重复写入时被跳过
+                law_id = content_id(processed_law["content"])
                 self.add_to_legal(
                     law_id, processed_law["content"], processed_law["metadata"]
                 )
@@ -211,6 +286,7 @@ class Agent:
         else:
             return {"needed_reference": False}
 
+    @traced("agent.need_legal_reference")
     def _need_legal_reference(self, history_context: str) -> bool:
         instruction = (
             f"You are a {self.role}. {self.description}\n\n"
@@ -223,17 +299,24 @@ class Agent:
             + history_context
             + "\n\nIs additional legal reference needed? Output true unless it is absolutely unnecessary. Provide only a simple 'true' or 'false' answer."
         )
+        # 回答只有一个词，流式读取提前停止省不了多少时间，却绕过了批量生成和缓存
         response = self.llm.generate(instruction=instruction, prompt=prompt)
+        return bool(self._parse_boolean(response))
 
-        cleaned_response = response.strip().lower()
-
-        # 检查响应是否包含 'true' 或 'false'
-        if "true" in cleaned_response:
-            return True
-        elif "false" in cleaned_response:
-            return False
-        else:
-            return False
+    @staticmethod
+    def _parse_boolean(response: str):
+        """
+        :return: 回复中最先出现的 'true' 或 'false'；都没有时返回 None
+        """
+        cleaned_response = response.lower()
+        positions = {
+            value: cleaned_response.find(word)
+            for value, word in ((True, "true"), (False, "false"))
+            if word in cleaned_response
+        }
+        if not positions:
+            return None
+        return min(positions, key=positions.get)
 
     def _process_law(self, law: dict) -> Dict[str, Any]:
 
@@ -246,6 +329,7 @@ class Agent:
             "metadata": {"lawName": law["lawsName"], "articleTag": law["articleTag"]},
         }
 
+    @traced("agent.reflect_on_experience")
     def _reflect_on_experience(
         self, case_content: str, history_context: str
     ) -> Dict[str, Any]:
@@ -253,7 +337,7 @@ class Agent:
         experience = self._generate_experience_summary(case_content, history_context)
 
         experience_entry = {
-            "id": str(uuid.uuid4()),
+            "id": content_id(experience["context"]),
             "content": experience["context"],  # 这里面放的应该是案件相关的描述
             "metadata": {
                 "context": experience["content"],  # 这里面放的应该是案件相关的指导用
@@ -309,6 +393,7 @@ class Agent:
         #           data[key] = ", ".join(value)
         # return data
 
+    @traced("agent.reflect_on_case")
     def _reflect_on_case(
         self, case_content: str, history_context: str
     ) -> Dict[str, Any]:
@@ -316,7 +401,7 @@ class Agent:
         case_summary = self._generate_case_summary(case_content, history_context)
 
         case_entry = {
-            "id": str(uuid.uuid4()),
+            "id": content_id(case_summary["content"]),
             "content": case_summary["content"],
             "metadata": {
                 "caseType": case_summary["case_type"],
@@ -418,15 +503,11 @@ class Agent:
         self.db.add_to_legal(id, document, metadata)
 
     def prepare_history_context(self, history_list: List[Dict[str, str]]) -> str:
-        formatted_history = []
-        for entry in history_list:
-            role = entry["role"]
-            name = entry["name"]
-            content = entry["content"].replace("\n", "\n  ")
-            formatted_entry = f"{role} ({name}):\n  {content}"
-            formatted_history.append(formatted_entry)
-        return "\n\n".join(formatted_history)
+        if not isinstance(history_list, CourtHistory):
+            history_list = CourtHistory(history_list)
+        return history_list.render()
 
+    @traced("agent.prepare_case_content")
     def prepare_case_content(self, history_context: str) -> str:
         instruction = f"你是一个专业的法官。擅长总结案件情况。\n\n"
 
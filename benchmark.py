@@ -0,0 +1,409 @@
+import argparse
+import contextvars
+import hashlib
+import json
+import math
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from chromadb import Documents, EmbeddingFunction, Embeddings
+
+import main as court
+from agent import Agent
+from EMDB.embedding import set_embedding_function
+from LLM.deli_client import set_law_search_backend
+from LLM.law_search import LawSearchBackend
+from LLM.llm import LLM
+
+# 当前调用所处的阶段（plan / execute / reflect），用于统计各阶段的 LLM 调用
+_phase = contextvars.ContextVar("benchmark_phase", default="other")
+
+_VOCABULARY = (
+    "原告 被告 合同 违约 赔偿 劳动 工资 加班 解除 证据 事实 理由 诉讼请求 "
+    "法院 判决 争议 责任 损失 支付 履行 约定 主张 抗辩 证明 期限"
+).split()
+
+
+@contextmanager
+def phase(name):
+    token = _phase.set(name)
+    try:
+        yield
+    finally:
+        _phase.reset(token)
+
+
+def _stable_fraction(text):
+    """
+    由文本得到 [0, 1) 内的确定性数值，不受线程调度和 PYTHONHASHSEED 影响
+    """
+    digest = hashlib.sha256(text.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64
+
+
+def _fake_text(seed_text, length):
+    rng = random.Random(seed_text)
+    words = []
+    while sum(len(word) for word in words) < length:
+        words.append(rng.choice(_VOCABULARY))
+    return "".join(words)[:length]
+
+
+def _summary(values):
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(int(0.95 * len(ordered)), len(ordered) - 1)],
+        "max": ordered[-1],
+    }
+
+
+class BenchmarkMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.llm_calls = defaultdict(
+            lambda: {"prompt_chars": [], "completion_chars": []}
+        )
+        self.retrieval_seconds = []
+        self.case_seconds = []
+
+    def record_llm(self, prompt_chars, completion_chars):
+        with self._lock:
+            calls = self.llm_calls[_phase.get()]
+            calls["prompt_chars"].append(prompt_chars)
+            calls["completion_chars"].append(completion_chars)
+
+    def record_retrieval(self, seconds):
+        with self._lock:
+            self.retrieval_seconds.append(seconds)
+
+    def record_case(self, seconds):
+        with self._lock:
+            self.case_seconds.append(seconds)
+
+    def report(self):
+        with self._lock:
+            return {
+                "llm_calls": {
+                    name: {
+                        "calls": len(calls["prompt_chars"]),
+                        "prompt_chars": _summary(calls["prompt_chars"]),
+                        "completion_chars": _summary(calls["completion_chars"]),
+                    }
+                    for name, calls in sorted(self.llm_calls.items())
+                },
+                "retrieval_seconds": _summary(self.retrieval_seconds),
+                "case_seconds": _summary(self.case_seconds),
+            }
+
+
+class FakeLLM(LLM):
+    """
+    按提示词类型返回格式正确的确定性回复，并可注入延迟
+    """
+
+    def __init__(self, metrics, latency=0.0, jitter=0.0, response_chars=200):
+        self.metrics = metrics
+        self.latency = latency
+        self.jitter = jitter
+        self.response_chars = response_chars
+
+    def _respond(self, instruction, prompt):
+        key = instruction + prompt
+        if "key-value pairs for experience, case, and legal" in prompt:
+            return json.dumps({"experience": True, "case": True, "legal": True})
+        if "'query':" in prompt:
+            query = " ".join(random.Random(key).sample(_VOCABULARY, 3))
+            return json.dumps({"query": query}, ensure_ascii=False)
+        if "Is additional legal reference needed" in prompt:
+            return "true"
+        if "queries do not cover" in prompt:
+            # 约四分之一的预先规划在复核后需要重新规划
+            return "true" if _stable_fraction(key) < 0.25 else "false"
+        if '"focus_points"' in prompt:
+            return json.dumps(
+                {
+                    "context": _fake_text(key + "context", 80),
+                    "content": _fake_text(key + "content", 120),
+                    "focus_points": _fake_text(key + "focus", 40),
+                    "guidelines": _fake_text(key + "guidelines", 40),
+                },
+                ensure_ascii=False,
+            )
+        if '"quick_reaction_points"' in prompt:
+            return json.dumps(
+                {
+                    "content": _fake_text(key + "content", 120),
+                    "case_type": "劳动争议",
+                    "keywords": _fake_text(key + "keywords", 20),
+                    "quick_reaction_points": _fake_text(key + "points", 40),
+                    "response_directions": _fake_text(key + "directions", 40),
+                },
+                ensure_ascii=False,
+            )
+        return _fake_text(key, self.response_chars)
+
+    def _sleep(self, instruction, prompt):
+        delay = self.latency + self.jitter * _stable_fraction(instruction + prompt)
+        if delay > 0:
+            time.sleep(delay)
+
+    def generate(self, instruction, prompt, *args, **kwargs):
+        self._sleep(instruction, prompt)
+        response = self._respond(instruction, prompt)
+        self.metrics.record_llm(len(instruction) + len(prompt), len(response))
+        return response
+
+    def stream(self, instruction, prompt, *args, **kwargs):
+        self._sleep(instruction, prompt)
+        response = self._respond(instruction, prompt)
+        self.metrics.record_llm(len(instruction) + len(prompt), len(response))
+        for start in range(0, len(response), 16):
+            yield response[start : start + 16]
+
+
+class FakeEmbeddingFunction(EmbeddingFunction[Documents]):
+    """
+    由字符二元组哈希得到的确定性归一化向量
+    """
+
+    def __init__(self, dimensions=64, latency=0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+
+    def __call__(self, input: Documents) -> Embeddings:
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return [self._embed(document) for document in input]
+
+    def _embed(self, document):
+        vector = [0.0] * self.dimensions
+        for i in range(max(len(document) - 1, 1)):
+            bucket = int(_stable_fraction(document[i : i + 2]) * self.dimensions)
+            vector[bucket] += 1.0
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+
+class FakeLawSearch(LawSearchBackend):
+    def __init__(self, latency=0.0, corpus_size=500):
+        self.latency = latency
+        self.corpus_size = corpus_size
+
+    def search(self, query, top_k=5):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        # search_law 已把 Agent 的 JSON 查询转换为文本
+        start = int(_stable_fraction(str(query)) * self.corpus_size)
+        return [
+            {
+                "lawsName": f"中华人民共和国测试法{(start + i) % 20}",
+                "articleTag": f"第{(start + i) % self.corpus_size + 1}条",
+                "articleContent": _fake_text(f"law{start + i}", 100),
+            }
+            for i in range(top_k)
+        ]
+
+
+class BenchmarkAgent(Agent):
+    metrics = None
+
+    def plan(self, history_list):
+        with phase("plan"):
+            return super().plan(history_list)
+
+    def execute(self, *args, **kwargs):
+        with phase("execute"):
+            return super().execute(*args, **kwargs)
+
+    def reflect(self, history_list):
+        with phase("reflect"):
+            return super().reflect(history_list)
+
+    def retrieve(self, queries):
+        start = time.perf_counter()
+        try:
+            return super().retrieve(queries)
+        finally:
+            self.metrics.record_retrieval(time.perf_counter() - start)
+
+
+class BenchmarkSimulation(court.CourtSimulation):
+    agent_class = BenchmarkAgent
+
+    def __init__(self, config_path, case_path, metrics, options, workers, seed):
+        self.metrics = metrics
+        self.options = options
+        super().__init__(config_path, case_path, "WARNING", workers=workers, seed=seed)
+
+    def create_llm(self):
+        return FakeLLM(
+            self.metrics,
+            latency=self.options.llm_latency,
+            jitter=self.options.llm_jitter,
+            response_chars=self.options.response_chars,
+        )
+
+    def setup_law_search(self, law_config):
+        set_law_search_backend(
+            FakeLawSearch(self.options.search_latency),
+            law_config.get("cache_size", 1024),
+        )
+
+    def create_agent(self, role_config, log_think=False):
+        agent = super().create_agent(role_config, log_think=log_think)
+        agent.metrics = self.metrics
+        return agent
+
+    def final_judgment(self):
+        # 判决由审判长直接调用 speak，不经过 plan/execute，单独计入 judgment
+        with phase("judgment"):
+            return super().final_judgment()
+
+    def run_case(self, index, case):
+        start = time.perf_counter()
+        try:
+            return super().run_case(index, case)
+        finally:
+            self.metrics.record_case(time.perf_counter() - start)
+
+
+def make_cases(count, seed):
+    rng = random.Random(seed)
+    cases = []
+    for i in range(count):
+        cases.append(
+            {
+                "plaintiff_statement": _fake_text(
+                    f"{seed}:{i}:plaintiff", rng.randint(150, 400)
+                ),
+                "defendant_statement": _fake_text(
+                    f"{seed}:{i}:defendant", rng.randint(150, 400)
+                ),
+            }
+        )
+    return cases
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def run_benchmark(args):
+    """
+    在临时目录中用假的 LLM、嵌入模型和法条检索跑完整的庭审流程
+    :return: 结果字典
+    """
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    config.pop("llm_cache", None)
+    config["stream"] = False
+    config.update(json.loads(args.override))
+
+    workdir = tempfile.mkdtemp(prefix="court-benchmark-")
+    cwd = os.getcwd()
+    court.console.quiet = not args.verbose
+    set_embedding_function(FakeEmbeddingFunction(latency=args.embedding_latency))
+    try:
+        os.chdir(workdir)
+        os.makedirs("test_result/ours/1", exist_ok=True)
+        with open("config.json", "w", encoding="utf-8") as f:
+            json.dump(config, f, ensure_ascii=False)
+        with open("cases.jsonl", "w", encoding="utf-8") as f:
+            for case in make_cases(args.cases, args.seed):
+                f.write(json.dumps(case, ensure_ascii=False) + "\n")
+
+        metrics = BenchmarkMetrics()
+        simulation = BenchmarkSimulation(
+            "config.json", "cases.jsonl", metrics, args, args.workers, args.seed
+        )
+        start = time.perf_counter()
+        simulation.run_simulation()
+        for agent in simulation.lawyers:
+            agent.db.flush()
+        elapsed = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+        if args.keep_workdir:
+            print(f"Working directory kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "parameters": {
+            "cases": args.cases,
+            "workers": args.workers,
+            "seed": args.seed,
+            "llm_latency": args.llm_latency,
+            "llm_jitter": args.llm_jitter,
+            "embedding_latency": args.embedding_latency,
+            "search_latency": args.search_latency,
+            "response_chars": args.response_chars,
+            "override": json.loads(args.override),
+        },
+        "elapsed_seconds": elapsed,
+        "cases_per_hour": args.cases / elapsed * 3600 if elapsed else None,
+        "peak_rss_mb": peak_rss_mb(),
+        **metrics.report(),
+    }
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the court pipeline with deterministic fake backends."
+    )
+    parser.add_argument("--config", default="example_role_config.json")
+    parser.add_argument("--cases", type=int, default=5)
+    parser.add_argument("--workers", type=court.positive_int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--llm-latency", type=float, default=0.0, help="Seconds per LLM call"
+    )
+    parser.add_argument(
+        "--llm-jitter",
+        type=float,
+        default=0.0,
+        help="Extra deterministic per-call latency, up to this many seconds",
+    )
+    parser.add_argument("--embedding-latency", type=float, default=0.0)
+    parser.add_argument("--search-latency", type=float, default=0.0)
+    parser.add_argument("--response-chars", type=int, default=200)
+    parser.add_argument(
+        "--override",
+        default="{}",
+        help="JSON object merged into the config, e.g. '{\"stream\": false}'",
+    )
+    parser.add_argument("--output", default="benchmark_result.json")
+    parser.add_argument("--verbose", action="store_true", help="Show court output")
+    parser.add_argument("--keep-workdir", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    result = run_benchmark(args)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    print(
+        f"{args.cases} cases in {result['elapsed_seconds']:.1f}s "
+        f"({result['cases_per_hour']:.0f} cases/hour), "
+        f"peak RSS {result['peak_rss_mb']:.0f} MB -> {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
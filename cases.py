@@ -0,0 +1,173 @@
+import bz2
+import gzip
+import hashlib
+import json
+import logging
+import lzma
+import os
+from array import array
+from typing import Dict, Iterator, Optional, Tuple
+
+# 按扩展名选择解压方式，未列出的按普通文本读取
+OPENERS = {".gz": gzip.open, ".bz2": bz2.open, ".xz": lzma.open}
+
+
+def parse_shard(text: str) -> Tuple[int, int]:
+    """
+    解析 "i/N" 形式的分片参数，i 从 0 开始
+    """
+    try:
+        shard, count = (int(part) for part in text.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must look like i/N, got {text!r}") from None
+    if count < 1 or not 0 <= shard < count:
+        raise ValueError(f"Shard index must be in [0, {count}), got {text!r}")
+    return shard, count
+
+
+class CaseSource:
+    """
+    JSONL 案例文件的惰性读取：顺序遍历时逐行解析，不把整个文件读入内存；
+    随机读取时使用旁边 .idx 文件中每个案例的字节偏移量，索引只在文件变化后重建。
+    支持 .gz/.bz2/.xz 压缩文件，压缩文件的随机读取需要从头解压到目标位置。
+    案例索引始终是在整个文件中的行号，分片之间不会重复。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        start: int = 0,
+        limit: Optional[int] = None,
+        shard: Tuple[int, int] = (0, 1),
+    ):
+        """
+        :param path: 案例文件路径
+        :param start: 从第几个案例开始
+        :param limit: 最多选取的案例数（分片前），为 None 时直到文件末尾
+        :param shard: (i, N)，只选取选中范围内索引模 N 余 i 的案例
+        """
+        self.path = path
+        self.start = start
+        self.stop = None if limit is None else start + limit
+        self.shard, self.shard_count = shard
+        self.index_path = path + ".idx"
+        self._opener = OPENERS.get(os.path.splitext(path)[1], open)
+        self._offsets = None
+
+    def describe(self) -> Dict:
+        """
+        数据文件、选取范围和分片，用于区分同一目录下的不同运行
+        """
+        return {
+            "source": os.path.abspath(self.path),
+            "start": self.start,
+            "stop": self.stop,
+            "shard": f"{self.shard}/{self.shard_count}",
+        }
+
+    @property
+    def key(self) -> str:
+        raw = json.dumps(self.describe(), sort_keys=True)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+    def selected(self, index: int) -> bool:
+        if index < self.start or (self.stop is not None and index >= self.stop):
+            return False
+        return index % self.shard_count == self.shard
+
+    def _lines(self) -> Iterator[Tuple[int, int, bytes]]:
+        """
+        :return: (案例索引, 字节偏移量, 行内容)，跳过空行
+        """
+        index = 0
+        offset = 0
+        with self._opener(self.path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    yield index, offset, line
+                    index += 1
+                offset += len(line)
+
+    def iter_cases(self, first: int = 0) -> Iterator[Tuple[int, Dict]]:
+        """
+        顺序读取选中的案例
+        :param first: 跳过索引小于该值的案例，用于断点续跑
+        :return: (案例索引, 案例数据) 的生成器
+        """
+        first = max(first, self.start)
+        for index, _, line in self._lines():
+            if self.stop is not None and index >= self.stop:
+                break
+            if index >= first and self.selected(index):
+                yield index, json.loads(line)
+
+    def __iter__(self) -> Iterator[Tuple[int, Dict]]:
+        return self.iter_cases()
+
+    def _source_stamp(self) -> Dict[str, int]:
+        stat = os.stat(self.path)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    def _load_index(self) -> Optional[array]:
+        if not os.path.exists(self.index_path):
+            return None
+        # 索引损坏或与数据文件不一致时重建
+        try:
+            with open(self.index_path, "rb") as f:
+                header = json.loads(f.readline())
+                if header.get("source") != self._source_stamp():
+                    return None
+                offsets = array("Q")
+                offsets.frombytes(f.read())
+        except ValueError:
+            return None
+        if len(offsets) != header.get("count"):
+            return None
+        return offsets
+
+    def build_index(self) -> array:
+        """
+        扫描一遍文件，记录每个案例的起始偏移量并写入 .idx 文件；
+        压缩文件记录的是解压后的偏移量
+        """
+        offsets = array("Q", (offset for _, offset, _ in self._lines()))
+        header = {"source": self._source_stamp(), "count": len(offsets)}
+        temp_path = f"{self.index_path}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                f.write(json.dumps(header).encode("utf-8") + b"\n")
+                f.write(offsets.tobytes())
+            os.replace(temp_path, self.index_path)
+        except OSError as e:
+            # 数据目录只读时只在内存中使用索引
+            logging.warning(f"Failed to write case index {self.index_path}: {e}")
+        return offsets
+
+    @property
+    def offsets(self) -> array:
+        if self._offsets is None:
+            self._offsets = self._load_index()
+            if self._offsets is None:
+                self._offsets = self.build_index()
+        return self._offsets
+
+    def __getitem__(self, index: int) -> Dict:
+        """
+        按索引读取单个案例
+        """
+        offset = self.offsets[index]
+        with self._opener(self.path, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def __len__(self) -> int:
+        """
+        选中的案例数；需要索引
+        """
+        total = len(self.offsets)
+        stop = total if self.stop is None else min(self.stop, total)
+        if stop <= self.start:
+            return 0
+        # 统计 [start, stop) 中模 N 余 shard 的整数个数
+        first = self.start + (self.shard - self.start) % self.shard_count
+        return max(0, (stop - first + self.shard_count - 1) // self.shard_count)
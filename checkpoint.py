@@ -0,0 +1,137 @@
+import json
+import logging
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional
+
+# 案例的进行阶段，按先后顺序排列
+STAGES = ("opening", "debate", "judgment", "reflection")
+
+
+def encode_rng_state(state) -> List[Any]:
+    """
+    把 random.Random.getstate() 的结果转换为可写入 JSON 的列表
+    """
+    version, internal, gauss_next = state
+    return [version, list(internal), gauss_next]
+
+
+def decode_rng_state(state: List[Any]):
+    """
+    encode_rng_state 的逆操作，结果可直接传给 random.Random.setstate()
+    """
+    version, internal, gauss_next = state
+    return version, tuple(internal), gauss_next
+
+
+class CaseCheckpoint:
+    """
+    单个案例的断点，每完成一次发言、判决或一名律师的反思后整体重写。
+    先写临时文件再替换，中途崩溃时磁盘上总是上一个完整的断点；
+    案例（包括反思）全部完成后删除。
+    文件名和内容中都带有案例来源（CaseSource.key），不同数据文件、范围或分片
+    共用同一目录时不会恢复到别的数据集的案例。
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        source: str,
+        case_index: int,
+        data: Optional[Dict] = None,
+    ):
+        """
+        :param directory: 断点目录
+        :param source: 案例来源的标识，即 CaseSource.key
+        :param case_index: 案例索引
+        :param data: 已有的断点内容，为 None 时从头开始
+        """
+        self.directory = directory
+        self.source = source
+        self.case_index = case_index
+        self.path = self.checkpoint_path(directory, source, case_index)
+        self.data = data or {
+            "source": source,
+            "case_index": case_index,
+            "stage": STAGES[0],
+        }
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def checkpoint_path(directory: str, source: str, case_index: int) -> str:
+        return os.path.join(directory, f"case_{source}_{case_index}.json")
+
+    @classmethod
+    def load(
+        cls, directory: str, source: str, case_index: int
+    ) -> Optional["CaseCheckpoint"]:
+        """
+        :return: 未完成案例的断点；不存在或来源不一致时返回 None
+        """
+        path = cls.checkpoint_path(directory, source, case_index)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("source") != source or data.get("case_index") != case_index:
+            logging.warning(
+                f"Ignoring checkpoint {path}: it belongs to source "
+                f"{data.get('source')} case {data.get('case_index')}"
+            )
+            return None
+        return cls(directory, source, case_index, data)
+
+    @staticmethod
+    def pending(directory: str, source: str) -> List[int]:
+        """
+        :param source: 案例来源的标识，其他来源的断点不计入
+        :return: 目录中该来源所有未完成案例的索引，从小到大排列
+        """
+        if not os.path.isdir(directory):
+            return []
+        pattern = re.compile(rf"case_{re.escape(source)}_(\d+)\.json")
+        indices = []
+        for name in os.listdir(directory):
+            match = pattern.fullmatch(name)
+            if match:
+                indices.append(int(match.group(1)))
+        return sorted(indices)
+
+    @property
+    def stage(self) -> str:
+        return self.data["stage"]
+
+    def update(self, **fields):
+        """
+        更新断点字段并写入磁盘
+        """
+        with self._lock:
+            self.data.update(fields)
+            self._write_locked()
+
+    def commit_reflection(self, lawyer_name: str):
+        """
+        记录某位律师本案的记忆已全部写入数据库，恢复时不再重复反思
+        """
+        with self._lock:
+            self.data.setdefault("reflected", []).append(lawyer_name)
+            self._write_locked()
+
+    def reflected(self) -> List[str]:
+        with self._lock:
+            return list(self.data.get("reflected", []))
+
+    def _write_locked(self):
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        with self._lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -0,0 +1,156 @@
+import threading
+from typing import Any, Dict, Iterator, List, Optional
+
+
+def format_entry(entry: Dict[str, str]) -> str:
+    """
+    将一条发言格式化为对话记录中的一段
+    """
+    content = entry["content"].replace("\n", "\n  ")
+    return f"{entry['role']} ({entry['name']}):\n  {content}"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    粗略估计 token 数：中文约一字一个 token，其余字符约四个一个 token
+    """
+    cjk = sum(1 for ch in text if "\u4e00" <= ch <= "\u9fff")
+    return cjk + (len(text) - cjk) // 4
+
+
+class RollingSummary:
+    """
+    历史压缩：超过 max_tokens 时，只保留最近 keep_last 条发言原文，
+    更早的发言增量折叠进滚动摘要。每个前缀的摘要只生成一次。
+    """
+
+    instruction = "你是法庭的书记员，负责整理庭审记录。"
+
+    def __init__(self, llm: Any, max_tokens: int = 6000, keep_last: int = 6):
+        self.llm = llm
+        self.max_tokens = max_tokens
+        self.keep_last = keep_last
+        self._summaries = {0: ""}  # 已折叠的发言条数 -> 摘要
+        self._lock = threading.Lock()
+
+    def summarize(self, summary: str, entries: List[Dict[str, str]]) -> str:
+        transcript = CourtHistory.separator.join(format_entry(e) for e in entries)
+        prompt = (
+            f"已有的庭审摘要：\n{summary or '（无）'}\n\n"
+            f"新增的庭审记录：\n{transcript}\n\n"
+            "请把新增记录合并进摘要，保留各方的诉讼请求、事实与理由、证据、争议焦点"
+            "以及审判长的提问，不要遗漏关键事实。只输出更新后的摘要。"
+        )
+        return self.llm.generate(self.instruction, prompt).strip()
+
+    def summary_for(self, entries: List[Dict[str, str]], count: int) -> str:
+        """
+        返回前 count 条发言的摘要，从已有的最长前缀摘要开始增量折叠
+        """
+        with self._lock:
+            if count not in self._summaries:
+                start = max(n for n in self._summaries if n <= count)
+                self._summaries[count] = self.summarize(
+                    self._summaries[start], entries[start:count]
+                )
+            return self._summaries[count]
+
+    def render(self, entries: List[Dict[str, str]]) -> str:
+        count = max(len(entries) - self.keep_last, 0)
+        parts = [format_entry(e) for e in entries[count:]]
+        if count:
+            summary = self.summary_for(entries, count).replace("\n", "\n  ")
+            parts.insert(0, f"此前庭审记录摘要:\n  {summary}")
+        return CourtHistory.separator.join(parts)
+
+
+class CourtHistory:
+    """
+    只追加的法庭历史。每次追加时增量更新格式化后的对话文本及各角色视图，
+    读取时无需重新拼接整个列表。
+    """
+
+    separator = "\n\n"
+
+    def __init__(
+        self,
+        entries: Optional[List[Dict[str, str]]] = None,
+        compaction: Optional[RollingSummary] = None,
+    ):
+        """
+        :param compaction: 历史过长时的压缩方式；为 None 时始终返回完整记录
+        """
+        self._entries = []
+        self._rendered = ""
+        self._role_rendered = {}
+        self._tokens = 0
+        self.compaction = compaction
+        self._lock = threading.Lock()
+        for entry in entries or []:
+            self.append(entry)
+
+    def append(self, entry: Dict[str, str]):
+        formatted = format_entry(entry)
+        with self._lock:
+            self._entries.append(entry)
+            self._rendered = self._join(self._rendered, formatted)
+            self._tokens += estimate_tokens(formatted)
+            role = entry["role"]
+            self._role_rendered[role] = self._join(
+                self._role_rendered.get(role, ""), formatted
+            )
+
+    def _join(self, rendered: str, formatted: str) -> str:
+        return rendered + self.separator + formatted if rendered else formatted
+
+    def render(self, role: Optional[str] = None, full: bool = False) -> str:
+        """
+        :param role: 仅返回该角色的发言；为 None 时返回对话记录
+        :param full: 为 True 时不做压缩，返回完整对话记录
+        """
+        if role is not None:
+            return self._role_rendered.get(role, "")
+        if (
+            full
+            or self.compaction is None
+            or self._tokens <= self.compaction.max_tokens
+        ):
+            return self._rendered
+        return self.compaction.render(self._entries)
+
+    @property
+    def tokens(self) -> int:
+        """
+        完整对话记录的估计 token 数
+        """
+        return self._tokens
+
+    def snapshot(self) -> "CourtHistory":
+        """
+        当前历史的只读副本，供其他线程在本历史继续追加时使用
+        """
+        with self._lock:
+            copy = CourtHistory.__new__(CourtHistory)
+            copy._entries = list(self._entries)
+            copy._rendered = self._rendered
+            copy._role_rendered = dict(self._role_rendered)
+            copy._tokens = self._tokens
+            # 压缩状态（已生成的摘要）与快照共享
+            copy.compaction = self.compaction
+            copy._lock = threading.Lock()
+            return copy
+
+    def to_list(self) -> List[Dict[str, str]]:
+        return list(self._entries)
+
+    def __iter__(self) -> Iterator[Dict[str, str]]:
+        return iter(list(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getitem__(self, index):
+        return self._entries[index]
+
+    def __str__(self) -> str:
+        return self._rendered
@@ -1,41 +1,108 @@
+import time
+
+# 尽早记录，--check-config 据此检查启动耗时
+_IMPORT_START = time.perf_counter()
+
 import json
 import os
 import random
+import sys
 import logging
 import argparse
+import copy
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from rich.console import Console
 from rich.logging import RichHandler
+from rich.live import Live
 from rich.panel import Panel
+from rich.text import Text
 from tqdm import trange
 
+from EMDB.consolidate import consolidate_db
 from EMDB.db import db
-from LLM.offlinellm import OfflineLLM
-from LLM.apillm import APILLM
+from LLM.cache import CachedLLM, ResponseCache
+from LLM.deli_client import DeliLawSearch, set_law_search_backend
+from LLM.law_search import LocalLawIndex
+from LLM.resilience import DeadlineExceeded, deadline, run_in_context
+from LLM.traced import TracedLLM
 from agent import Agent
+from cases import CaseSource, parse_shard
+from checkpoint import CaseCheckpoint, decode_rng_state, encode_rng_state
+from history import CourtHistory, RollingSummary
+from transcript import TranscriptSink
+import tracing
 
 console = Console()
 
 
 class CourtSimulation:
-    def __init__(self, config_path, case_data, log_level, log_think=False):
+    agent_class = Agent
+
+    def __init__(
+        self,
+        config_path,
+        case_data,
+        log_level,
+        log_think=False,
+        workers=1,
+        seed=None,
+        headless=False,
+        output_dir="test_result/ours/1",
+        compress=False,
+        start=0,
+        limit=None,
+        shard=(0, 1),
+    ):
         """
         初始化法庭模拟类
         :param config_path: 配置文件路径
-        :param case_data: 案例数据（可以是单个文件路径或包含多个案例的目录路径）
+        :param case_data: 案例文件路径（JSONL，可以是 .gz/.bz2/.xz 压缩文件）
         :param log_level: 日志级别
+        :param workers: 并行模拟的案例数
+        :param seed: 随机种子，给定后每个案例的随机过程与调度顺序无关
+        :param headless: 不在控制台渲染发言，所有案例的记录追加到一个 JSONL 文件
+        :param output_dir: 庭审记录的输出目录
+        :param compress: 无界面模式下用 gzip 压缩记录文件
+        :param start: 从第几个案例开始
+        :param limit: 最多模拟的案例数，为 None 时直到文件末尾
+        :param shard: (i, N)，只模拟索引模 N 余 i 的案例，用于多台机器分担
         """
         self.setup_logging(log_level)
+        self.workers = workers
+        self.seed = seed
+        self.headless = headless
+        self.output_dir = output_dir
+        self.transcript = TranscriptSink(output_dir, compress) if headless else None
+        self.case_label = None
+        self.checkpoint = None
+        self.reflection_executor = None
+        self.pending_reflections = deque()
         self.config = self.load_json(config_path)
-        self.case_data = self.load_case_data(case_data)
-        if self.config["llm_type"] == "offline":
-            self.llm = OfflineLLM(self.config["model_path"])
-        elif self.config["llm_type"] == "apillm":
-            self.llm = APILLM(
-                api_key=self.config["api_key"],
-                api_secret=self.config.get("api_secret", None),
-                platform=self.config["model_platform"],
-                model=self.config["model_type"],
+        # 多个案例并行时控制台无法同时刷新多个面板，只在单线程模式下流式输出
+        self.stream_output = (
+            self.config.get("stream", False) and workers == 1 and not headless
+        )
+        self.case_data = self.load_case_data(case_data, start, limit, shard)
+        self.checkpoint_dir = self.config.get("checkpoint_dir", "checkpoints")
+        # 不同数据文件、范围或分片的进度分开记录，在同一目录下运行互不覆盖
+        self.progress_path = os.path.join(
+            self.checkpoint_dir, f"progress_{self.case_data.key}.json"
+        )
+        self.llm = self.create_llm()
+        cache_config = self.config.get("llm_cache")
+        if cache_config:
+            cache = ResponseCache(
+                cache_config.get("path", "llm_cache/responses.sqlite"),
+                max_bytes=int(cache_config.get("max_mb", 1024) * 1024 * 1024),
+            )
+            self.llm = CachedLLM(
+                self.llm, cache, mode=cache_config.get("mode", "readwrite")
             )
+        if tracing.enabled():
+            self.llm = TracedLLM(self.llm)
+        self.setup_law_search(self.config.get("law_search", {}))
 
         self.judge = self.create_agent(self.config["judge"], log_think=log_think)
         self.lawyers = [
@@ -49,6 +116,57 @@ class CourtSimulation:
             "被告律师": "red",
         }
 
+    def create_llm(self):
+        """
+        根据配置创建 LLM
+        :return: LLM实例
+        """
+        # 只导入配置选中的后端，apillm 不需要加载 torch 和 transformers
+        if self.config["llm_type"] == "offline":
+            from LLM.offlinellm import OfflineLLM
+
+            return OfflineLLM(
+                self.config["model_path"],
+                device=self.config.get("device", "auto"),
+                max_batch_size=self.config.get("offline_batch_size", 8),
+                max_wait=self.config.get("offline_batch_wait", 0.02),
+                prefix_cache_mb=self.config.get("prefix_cache_mb", 0),
+            )
+        elif self.config["llm_type"] == "apillm":
+            from LLM.apillm import APILLM
+
+            return APILLM(
+                api_key=self.config["api_key"],
+                api_secret=self.config.get("api_secret", None),
+                platform=self.config["model_platform"],
+                model=self.config["model_type"],
+                max_concurrency=self.config.get("max_concurrency", 8),
+                requests_per_minute=self.config.get("rate_limit", {}).get("rpm"),
+                tokens_per_minute=self.config.get("rate_limit", {}).get("tpm"),
+                request_timeout=self.config.get("request_timeout", 60.0),
+                max_retries=self.config.get("max_retries", 3),
+                hedge_after=self.config.get("hedge_after"),
+            )
+        raise ValueError(f"Unsupported llm_type: {self.config['llm_type']}")
+
+    @staticmethod
+    def setup_law_search(law_config):
+        """
+        设置法条检索后端
+        :param law_config: backend 为 "local" 时使用本地索引（index_path，
+            可选 corpus 用于首次建立索引），否则使用远程接口（url）
+        """
+        if law_config.get("backend", "remote") == "local":
+            backend = LocalLawIndex(
+                law_config.get("index_path", "law_index/laws.sqlite")
+            )
+            if not len(backend) and law_config.get("corpus"):
+                logging.info(f"Building law index from {law_config['corpus']}")
+                backend.load_corpus(law_config["corpus"])
+        else:
+            backend = DeliLawSearch(law_config.get("url", ""))
+        set_law_search_backend(backend, law_config.get("cache_size", 1024))
+
     @staticmethod
     def setup_logging(log_level):
         """
@@ -73,18 +191,13 @@ class CourtSimulation:
             return json.load(f)
 
     @staticmethod
-    def load_case_data(case_path):
+    def load_case_data(case_path, start=0, limit=None, shard=(0, 1)):
         """
-        加载案例数据
-        :param case_path: 案例文件路径或目录路径
-        :return: 包含所有案例数据的列表
+        加载案例数据；案例在模拟时才逐个读取
+        :param case_path: 案例文件路径
+        :return: CaseSource实例
         """
-        cases = []
-        with open(case_path, "r", encoding="utf-8") as file:
-            for line in file:
-                case = json.loads(line)
-                cases.append(case)
-        return cases
+        return CaseSource(case_path, start=start, limit=limit, shard=shard)
 
     def create_agent(self, role_config, log_think=False):
         """
@@ -92,13 +205,18 @@ class CourtSimulation:
         :param role_config: 角色配置
         :return: Agent实例
         """
-        return Agent(
+        return self.agent_class(
             id=role_config["id"],
             name=role_config["name"],
             role=role_config.get("role", None),
             description=role_config["description"],
             llm=self.llm,
-            db=db(role_config["name"]),
+            db=db(
+                role_config["name"],
+                buffer_size=self.config.get("db_buffer_size", 32),
+                flush_interval=self.config.get("db_flush_interval", 5.0),
+                dedup_distance=self.config.get("db_dedup_distance"),
+            ),
             log_think=log_think,
         )
 
@@ -110,16 +228,75 @@ class CourtSimulation:
         :param content: 对话内容
         """
         self.global_history.append({"role": role, "name": name, "content": content})
+        if not self.headless:
+            console.print(self.make_panel(role, name, content))
+
+    def make_panel(self, role, name, content):
+        """
+        生成发言的显示面板
+        :param content: 发言内容，可以是字符串或rich的Text
+        """
         color = self.role_colors.get(role, "white")
-        console.print(
-            Panel(content, title=f"{role} ({name})", border_style=color, expand=False)
+        title = f"{role} ({name})"
+        if self.case_label:
+            title = f"[{self.case_label}] {title}"
+        return Panel(content, title=title, border_style=color, expand=False)
+
+    def stream_to_history(self, role, name, speak):
+        """
+        流式生成发言，边生成边显示，完成后加入历史记录
+        :param role: 说话角色
+        :param name: 说话人名字
+        :param speak: 接收 on_token 回调并返回完整发言的函数
+        """
+        if not self.stream_output:
+            self.add_to_history(role, name, speak(None))
+            return
+
+        text = Text()
+        start = time.perf_counter()
+        first_token_time = None
+        with Live(
+            self.make_panel(role, name, text), console=console, refresh_per_second=8
+        ):
+
+            def on_token(chunk):
+                nonlocal first_token_time
+                if first_token_time is None:
+                    first_token_time = time.perf_counter() - start
+                text.append(chunk)
+
+            content = speak(on_token)
+        total_time = time.perf_counter() - start
+        if first_token_time is None:
+            first_token_time = total_time
+        logging.info(
+            f"{role} ({name}) time to first token: {first_token_time:.2f}s, "
+            f"total: {total_time:.2f}s"
+        )
+        self.global_history.append({"role": role, "name": name, "content": content})
+
+    def new_history(self):
+        """
+        创建空的法庭历史；配置了 history_compaction 时，过长的历史会被滚动摘要压缩
+        :return: CourtHistory实例
+        """
+        compaction_config = self.config.get("history_compaction")
+        if not compaction_config:
+            return CourtHistory()
+        return CourtHistory(
+            compaction=RollingSummary(
+                self.llm,
+                max_tokens=compaction_config.get("max_tokens", 6000),
+                keep_last=compaction_config.get("keep_last", 6),
+            )
         )
 
     def initialize_court(self):
         """
         初始化法庭
         """
-        self.global_history = []
+        self.global_history = self.new_history()
         court_rules = self.config["stenographer"]["court_rules"]
         self.add_to_history("书记员", self.config["stenographer"]["name"], court_rules)
         self.add_to_history(
@@ -204,47 +381,188 @@ class CourtSimulation:
         """
         法官初始提问
         """
-        content = self.judge.execute(
-            None,
-            history_list=self.global_history,
-            prompt="根据原告律师、被告律师的陈述，总结双方律师应该针对什么问题进行辩论，你的总结应该在符合现实的基础上，尽量简洁有效。",
+        self.stream_to_history(
+            "审判长",
+            self.judge.name,
+            lambda on_token: self.judge.execute(
+                None,
+                history_list=self.global_history,
+                prompt="根据原告律师、被告律师的陈述，总结双方律师应该针对什么问题进行辩论，你的总结应该在符合现实的基础上，尽量简洁有效。",
+                on_token=on_token,
+            ),
         )
-        self.add_to_history("审判长", self.judge.name, content)
 
-    def debate_rounds(self, rounds):
+    def debate_rounds(self, rounds, start_turn=0):
         """
         辩论环节
         :param rounds: 辩论轮数
+        :param start_turn: 从断点恢复时已完成的发言次数
         """
-        for i in trange(rounds, desc="Debate Rounds"):
-            logging.info(f"Starting debate round {i+1}")
-            for role, agent in [
-                ("原告律师", self.plaintiff),
-                ("被告律师", self.defendant),
-            ]:
-                p_q = agent.plan(self.global_history)
-                content = agent.execute(
-                    p_q,
-                    self.global_history,
-                    prompt=f"根据经验、法条、案例以及法庭对话记录，开始你的辩论。如果你引用了context中的法条库，请把引用的部分说出来。注意：1、当前为法庭辩论环节，而非法庭调查环节。2、你是{role}",
-                )
-                self.add_to_history(role, agent.name, content)
+        speakers = [("原告律师", self.plaintiff), ("被告律师", self.defendant)]
+        speculative = self.config.get("speculative_planning", False)
+        with ThreadPoolExecutor(max_workers=1) as planner:
+            pending = None
+            for i in trange(rounds, desc="Debate Rounds", disable=self.headless):
+                logging.info(f"Starting debate round {i+1}")
+                for j, (role, agent) in enumerate(speakers):
+                    turn = i * len(speakers) + j
+                    if turn < start_turn:
+                        continue
+                    p_q = self.take_speculative_plan(pending, agent)
+                    pending = None
+                    if p_q is None:
+                        p_q = agent.plan(self.global_history)
+
+                    # 当前律师发言期间，预先为下一位律师规划和检索
+                    is_last_turn = i == rounds - 1 and j == len(speakers) - 1
+                    if speculative and not is_last_turn:
+                        next_agent = speakers[(j + 1) % len(speakers)][1]
+                        pending = run_in_context(
+                            planner,
+                            next_agent.plan_ahead,
+                            self.global_history.snapshot(),
+                        )
+
+                    self.stream_to_history(
+                        role,
+                        agent.name,
+                        lambda on_token: agent.execute(
+                            p_q,
+                            self.global_history,
+                            prompt=f"根据经验、法条、案例以及法庭对话记录，开始你的辩论。如果你引用了context中的法条库，请把引用的部分说出来。注意：1、当前为法庭辩论环节，而非法庭调查环节。2、你是{role}",
+                            on_token=on_token,
+                        ),
+                    )
+                    self.save_checkpoint("debate", turn=turn + 1)
+
+    def take_speculative_plan(self, pending, agent):
+        """
+        取出预先制定的计划；若计划失败、落后当前历史过多，或复核后发现
+        没有覆盖之后的新发言则丢弃
+        :param pending: 预先规划任务的Future，可以为None
+        :param agent: 即将发言的律师
+        :return: 可复用的计划或None
+        """
+        if pending is None:
+            return None
+        try:
+            plan = pending.result()
+        except Exception as e:
+            logging.warning(f"Speculative planning failed, planning again: {e}")
+            return None
+        staleness = len(self.global_history) - plan["history_len"]
+        if staleness > self.config.get("max_plan_staleness", 1):
+            return None
+        # 计划没有看到对方刚才的发言，用一次简短的判断代替完整的重新规划
+        if staleness and not agent.revalidate_plan(plan, self.global_history):
+            logging.info(
+                f"Speculative plan of {agent.name} is outdated, planning again"
+            )
+            return None
+        return plan
 
     def final_judgment(self):
         """
         最终判决
         """
-        content = self.judge.speak(
-            self.global_history, prompt="法官请做出判决：(你的判决应该符合现实情况。)"
+        self.stream_to_history(
+            "审判长",
+            self.judge.name,
+            lambda on_token: self.judge.speak(
+                self.judge.prepare_history_context(self.global_history),
+                prompt="法官请做出判决：(你的判决应该符合现实情况。)",
+                on_token=on_token,
+            ),
+        )
+
+    def reflect_and_summary(self, index=None):
+        """
+        反思和总结；开启后台反思时提交到后台队列后立即返回
+        :param index: 当前案例索引
+        """
+        history = self.global_history.snapshot()
+        checkpoint = self.checkpoint
+        # 从断点恢复时跳过记忆已经写入的律师
+        reflected = checkpoint.reflected() if checkpoint is not None else []
+        lawyers = [
+            copy.copy(lawyer)
+            for lawyer in (self.plaintiff, self.defendant)
+            if lawyer.name not in reflected
+        ]
+        if self.reflection_executor is None:
+            self.reflect_lawyers(lawyers, history, checkpoint)
+            return
+        future = run_in_context(
+            self.reflection_executor,
+            self.reflect_lawyers,
+            lawyers,
+            history,
+            checkpoint,
         )
-        self.add_to_history("审判长", self.judge.name, content)
+        self.pending_reflections.append((index, future))
 
-    def reflect_and_summary(self):
+    @staticmethod
+    def reflect_lawyers(lawyers, history, checkpoint=None):
         """
-        反思和总结
+        原被告律师各自写入自己的数据库，可以并发反思
+        :param lawyers: 律师Agent列表
+        :param history: 本案法庭历史
+        :param checkpoint: 本案的断点，每名律师的记忆落盘后记录，全部完成后删除
         """
-        self.plaintiff.reflect(self.global_history)
-        self.defendant.reflect(self.global_history)
+        if lawyers:
+            with ThreadPoolExecutor(max_workers=len(lawyers)) as executor:
+                futures = [
+                    run_in_context(executor, lawyer.reflect, history)
+                    for lawyer in lawyers
+                ]
+                for lawyer, future in zip(lawyers, futures):
+                    try:
+                        future.result()
+                    except DeadlineExceeded:
+                        # 超出案例时间预算的反思不再重试，已写入的部分照常落盘
+                        logging.warning(
+                            f"Reflection of {lawyer.name} exceeded the case "
+                            "time budget"
+                        )
+                        lawyer.db.flush()
+                        continue
+                    # 清空写缓冲，确保该律师本案的记忆全部落盘后再记入断点
+                    lawyer.db.flush()
+                    if checkpoint is not None:
+                        checkpoint.commit_reflection(lawyer.name)
+        if checkpoint is not None:
+            checkpoint.remove()
+
+    def wait_for_reflections(self, before=None):
+        """
+        等待后台反思完成
+        :param before: 只等待案例索引小于该值的反思；为None时等待全部
+        """
+        while self.pending_reflections and (
+            before is None or self.pending_reflections[0][0] < before
+        ):
+            _, future = self.pending_reflections.popleft()
+            future.result()
+
+    def consolidate_memory(self, index):
+        """
+        每 consolidate_every 个案例整理一次律师的记忆库，使经验库和案例库不超过
+        memory_capacity 中设置的容量
+        :param index: 刚完成的案例索引
+        """
+        capacities = self.config.get("memory_capacity")
+        every = self.config.get("consolidate_every", 10)
+        if not capacities or (index + 1) % every:
+            return
+        # 整理前确保此前案例的反思都已写入
+        self.wait_for_reflections()
+        for lawyer in self.lawyers:
+            consolidate_db(
+                lawyer.db,
+                capacities,
+                llm=self.llm,
+                merge_distance=self.config.get("memory_merge_distance", 0.1),
+            )
 
     def assign_roles(self):
         """
@@ -259,50 +577,209 @@ class CourtSimulation:
 
     def save_progress(self, index):
         """
-        记录运行状态
-        :param index: 当前案例索引
+        记录运行状态；案例内部的进度由断点记录
+        :param index: 下一个要开始的案例索引
         """
-        progress = {"current_case_index": index}
-        with open("progress.json", "w") as f:
+        progress = {"current_case_index": index, **self.case_data.describe()}
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        temp_path = f"{self.progress_path}.tmp"
+        with open(temp_path, "w") as f:
             json.dump(progress, f)
+        os.replace(temp_path, self.progress_path)
 
     def load_progress(self):
         """
         加载运行状态
         :return: 运行状态字典或None
         """
-        if os.path.exists("progress.json"):
-            with open("progress.json", "r") as f:
+        if os.path.exists(self.progress_path):
+            with open(self.progress_path, "r") as f:
                 return json.load(f)
         return None
 
+    def save_checkpoint(self, stage, **fields):
+        """
+        把当前案例的阶段和法庭历史写入断点
+        :param stage: 恢复时应从哪个阶段继续
+        """
+        if self.checkpoint is None:
+            return
+        self.checkpoint.update(
+            stage=stage, history=self.global_history.to_list(), **fields
+        )
+
+    def restore_checkpoint(self, checkpoint):
+        """
+        从断点恢复法庭历史和随机数状态
+        :param checkpoint: CaseCheckpoint实例
+        """
+        self.global_history = self.new_history()
+        for entry in checkpoint.data.get("history", []):
+            self.global_history.append(entry)
+        if "rng_state" in checkpoint.data:
+            self.rng.setstate(decode_rng_state(checkpoint.data["rng_state"]))
+        logging.info(
+            f"Resuming case {checkpoint.case_index + 1} at stage "
+            f"{checkpoint.stage} ({len(self.global_history)} utterances)"
+        )
+
+    def case_rng(self, index):
+        """
+        每个案例独立的随机数生成器
+        :param index: 案例索引
+        :return: random.Random实例；未指定种子时使用系统熵
+        """
+        if self.seed is None:
+            return random.Random()
+        return random.Random(f"{self.seed}:{index}")
+
+    def fork(self, index):
+        """
+        为单个案例复制一份模拟状态，法庭历史和角色各自独立，LLM与数据库共享
+        :param index: 案例索引
+        :return: CourtSimulation实例
+        """
+        sim = copy.copy(self)
+        sim.judge = copy.copy(self.judge)
+        sim.lawyers = [copy.copy(lawyer) for lawyer in self.lawyers]
+        sim.global_history = sim.new_history()
+        sim.case_label = f"案例 {index + 1}"
+        return sim
+
+    def run_case(self, index, case):
+        """
+        模拟单个案例的完整庭审过程
+        :param index: 案例索引
+        :param case: 案例数据
+        :return: 本案的法庭历史
+        """
+        self.rng = self.case_rng(index)
+        source = self.case_data.key
+        self.checkpoint = CaseCheckpoint.load(self.checkpoint_dir, source, index)
+        if self.checkpoint is not None:
+            self.restore_checkpoint(self.checkpoint)
+        else:
+            self.checkpoint = CaseCheckpoint(self.checkpoint_dir, source, index)
+        stage = self.checkpoint.stage
+        with tracing.span("court.case", case=index + 1):
+            console.print(f"\n开始模拟案例 {index + 1}", style="bold")
+            # 超出单个案例的时间预算时，未完成的 LLM 和检索调用会尽快终止；
+            # 反思同样计入预算，后台反思经 run_in_context 继承同一截止时间
+            with deadline(self.config.get("case_time_budget")):
+                try:
+                    self.assign_roles()  # 随机分配角色
+                    if stage == "opening":
+                        console.print("除审判员的其他人员入场", style="bold")
+                        self.initialize_court()
+                        self.confirm_rights_and_obligations()
+                        self.initial_statements(case)
+                        self.judge_initial_question()
+
+                        stage = "debate"
+                        self.save_checkpoint(
+                            stage,
+                            rounds=self.rng.randint(3, 5),
+                            turn=0,
+                            rng_state=encode_rng_state(self.rng.getstate()),
+                        )
+                    if stage == "debate":
+                        self.debate_rounds(
+                            self.checkpoint.data["rounds"],
+                            start_turn=self.checkpoint.data["turn"],
+                        )
+                        stage = "judgment"
+                        self.save_checkpoint(stage)
+                    if stage == "judgment":
+                        self.final_judgment()
+                        stage = "reflection"
+                        self.save_checkpoint(stage, reflected=[])
+                except DeadlineExceeded:
+                    # 不完整的庭审不用于反思，只保存已有的记录
+                    logging.warning(
+                        f"Case {index + 1} exceeded its time budget, skipping"
+                    )
+                    self.save_case_log(index)
+                    self.checkpoint.remove()
+                else:
+                    # 先保存记录再反思，断点在本案记忆全部写入后才删除；
+                    # 从反思阶段恢复时记录已经写过，不再重复追加
+                    if not self.checkpoint.data.get("logged"):
+                        self.save_case_log(index)
+                        self.checkpoint.update(logged=True)
+                    self.reflect_and_summary(index)
+            console.print(f"案例 {index + 1} 庭审结束", style="bold")
+        tracing.write_metrics()
+        return self.global_history
+
     def run_simulation(self):
         """
         运行整个法庭模拟过程
         """
         progress = self.load_progress()
         start_index = progress["current_case_index"] if progress else 0
+        if start_index:
+            logging.warning(
+                f"Resuming from case {start_index + 1} recorded in "
+                f"{self.progress_path}; delete it to start over"
+            )
 
-        case_data_to_run = self.case_data[:62]
-        for index in range(start_index, len(case_data_to_run)):
-            case = case_data_to_run[index]
-            console.print(f"\n开始模拟案例 {index + 1}", style="bold")
-            console.print("除审判员的其他人员入场", style="bold")
-            self.assign_roles()  # 随机分配角色
-            self.initialize_court()
-            self.confirm_rights_and_obligations()
-            self.initial_statements(case)
-            self.judge_initial_question()
-
-            rounds = random.randint(3, 5)
-            self.debate_rounds(rounds)
-            self.save_progress(index)  # 记录当前进度
-
-            self.final_judgment()
-            self.reflect_and_summary()
-            console.print(f"案例 {index + 1} 庭审结束", style="bold")
+        # 进度之前仍有断点的案例（例如反思未完成）先从断点继续，按索引随机读取
+        pending = CaseCheckpoint.pending(self.checkpoint_dir, self.case_data.key)
+        resumed = (
+            (index, self.case_data[index])
+            for index in pending
+            if index < start_index and self.case_data.selected(index)
+        )
+        cases = itertools.chain(resumed, self.case_data.iter_cases(start_index))
+        if self.workers == 1:
+            if self.config.get("background_reflection", False):
+                self.reflection_executor = ThreadPoolExecutor(max_workers=1)
+            lag = self.config.get("reflection_lag", 1)
+            try:
+                for index, case in cases:
+                    # 屏障：案例N的记忆保证在案例N+1+lag开始前全部写入，
+                    # lag为0时与串行执行的可见性一致
+                    self.wait_for_reflections(before=index - lag)
+                    self.run_case(index, case)
+                    if index >= start_index:
+                        self.save_progress(index + 1)
+                    self.consolidate_memory(index)
+                self.wait_for_reflections()
+            finally:
+                if self.reflection_executor is not None:
+                    self.reflection_executor.shutdown(wait=True)
+                    self.reflection_executor = None
+            return
+
+        def finish(index, future):
+            future.result()
+            if index >= start_index:
+                self.save_progress(index + 1)
+            self.consolidate_memory(index)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            # 只提前读取有限个案例，按案例顺序收集结果，之前的案例全部完成才推进进度
+            in_flight = deque()
+            for index, case in cases:
+                future = executor.submit(self.fork(index).run_case, index, case)
+                in_flight.append((index, future))
+                if len(in_flight) >= self.workers * 2:
+                    finish(*in_flight.popleft())
+            while in_flight:
+                finish(*in_flight.popleft())
+
+    def save_case_log(self, index):
+        """
+        保存单个案例的庭审记录
+        :param index: 案例索引
+        """
+        if self.transcript is not None:
+            self.transcript.write_case(index, self.global_history.to_list())
+        else:
             self.save_court_log(
-                f"test_result/ours/1/court_session_test_case_{index + 1}.json"
+                os.path.join(
+                    self.output_dir, f"court_session_test_case_{index + 1}.json"
+                )
             )
 
     def save_court_log(self, file_path):
@@ -310,11 +787,168 @@ class CourtSimulation:
         保存法庭日志
         :param file_path: 保存文件路径
         """
+        os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
         with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(self.global_history, f, ensure_ascii=False, indent=2)
+            json.dump(self.global_history.to_list(), f, ensure_ascii=False, indent=2)
         logging.info(f"Court session log saved to {file_path}")
 
 
+# 这些模块只应在配置选中对应后端、真正开始模拟时才导入
+HEAVY_MODULES = ("torch", "transformers", "chromadb", "sentence_transformers")
+
+
+def validate_config(config):
+    """
+    检查配置是否完整、取值是否合法，不加载任何模型
+    :param config: 配置字典
+    :return: 错误信息列表，为空表示通过
+    """
+    errors = []
+
+    def check_number(key, minimum=0, section=config, prefix=""):
+        value = section.get(key)
+        if value is not None and (
+            not isinstance(value, (int, float))
+            or isinstance(value, bool)
+            or value < minimum
+        ):
+            errors.append(f"{prefix}{key} must be a number >= {minimum}")
+
+    llm_type = config.get("llm_type")
+    if llm_type == "offline":
+        if not config.get("model_path"):
+            errors.append("model_path is required for llm_type 'offline'")
+    elif llm_type == "apillm":
+        for key in ("api_key", "model_platform", "model_type"):
+            if not config.get(key):
+                errors.append(f"{key} is required for llm_type 'apillm'")
+        platform = config.get("model_platform")
+        if platform and platform not in ("openai", "wenxin", "zhipuai"):
+            errors.append(f"Unsupported model_platform: {platform}")
+        if platform == "wenxin" and not config.get("api_secret"):
+            errors.append("api_secret is required for model_platform 'wenxin'")
+    else:
+        errors.append(f"Unsupported llm_type: {llm_type}")
+
+    roles = [
+        ("judge", config.get("judge")),
+        ("stenographer", config.get("stenographer")),
+    ]
+    lawyers = config.get("lawyers")
+    if not isinstance(lawyers, list) or len(lawyers) < 2:
+        errors.append("lawyers must be a list of at least two lawyers")
+    else:
+        roles += [(f"lawyers[{i}]", lawyer) for i, lawyer in enumerate(lawyers)]
+    for name, role in roles:
+        if not isinstance(role, dict):
+            errors.append(f"{name} is required")
+            continue
+        for key in ("id", "name", "description"):
+            if key not in role:
+                errors.append(f"{name}.{key} is required")
+    stenographer = config.get("stenographer")
+    if isinstance(stenographer, dict) and "court_rules" not in stenographer:
+        errors.append("stenographer.court_rules is required")
+
+    for key in ("max_concurrency", "offline_batch_size", "db_buffer_size"):
+        check_number(key, minimum=1)
+    for key in (
+        "offline_batch_wait",
+        "prefix_cache_mb",
+        "db_flush_interval",
+        "db_dedup_distance",
+        "request_timeout",
+        "max_retries",
+        "case_time_budget",
+        "reflection_lag",
+        "max_plan_staleness",
+        "memory_merge_distance",
+    ):
+        check_number(key)
+    check_number("consolidate_every", minimum=1)
+    hedge_after = config.get("hedge_after")
+    if hedge_after != "p95":
+        check_number("hedge_after")
+
+    rate_limit = config.get("rate_limit", {})
+    for key in ("rpm", "tpm"):
+        check_number(key, minimum=1, section=rate_limit, prefix="rate_limit.")
+    cache_config = config.get("llm_cache")
+    if cache_config:
+        if cache_config.get("mode", "readwrite") not in CachedLLM.modes:
+            errors.append(f"Unsupported llm_cache.mode: {cache_config.get('mode')}")
+        check_number("max_mb", section=cache_config, prefix="llm_cache.")
+    history_config = config.get("history_compaction")
+    if history_config:
+        for key in ("max_tokens", "keep_last"):
+            check_number(key, section=history_config, prefix="history_compaction.")
+    capacities = config.get("memory_capacity") or {}
+    for key in capacities:
+        if key not in ("experience", "case"):
+            errors.append(f"Unsupported memory_capacity collection: {key}")
+        check_number(key, minimum=1, section=capacities, prefix="memory_capacity.")
+
+    law_config = config.get("law_search", {})
+    backend = law_config.get("backend", "remote")
+    if backend not in ("remote", "local"):
+        errors.append(f"Unsupported law_search.backend: {backend}")
+    if backend == "local":
+        index_path = law_config.get("index_path", "law_index/laws.sqlite")
+        corpus = law_config.get("corpus")
+        if not os.path.exists(index_path) and not corpus:
+            errors.append(
+                f"law_search: {index_path} does not exist and no corpus is given"
+            )
+        if corpus and not os.path.exists(corpus):
+            errors.append(f"law_search.corpus not found: {corpus}")
+    return errors
+
+
+def check_config(args):
+    """
+    --check-config：校验配置和案例文件并检查启动耗时，不加载任何模型
+    :return: 进程退出码
+    """
+    try:
+        config = CourtSimulation.load_json(args.config)
+    except (OSError, ValueError) as e:
+        console.print(f"无法读取配置文件 {args.config}: {e}", style="bold red")
+        return 1
+    errors = validate_config(config)
+    if not os.path.exists(args.case):
+        errors.append(f"Case file not found: {args.case}")
+
+    startup = time.perf_counter() - _IMPORT_START
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    if loaded:
+        errors.append(f"Heavy modules imported at startup: {', '.join(loaded)}")
+    if startup > args.startup_budget:
+        errors.append(
+            f"Startup took {startup:.2f}s, over the {args.startup_budget:.2f}s budget"
+        )
+
+    for error in errors:
+        console.print(f"[red]✗[/red] {error}")
+    if errors:
+        return 1
+    console.print(f"[green]✓[/green] {args.config} is valid (startup {startup:.2f}s)")
+    return 0
+
+
+def positive_int(text):
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
+
+
+def shard_type(text):
+    try:
+        return parse_shard(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
 def parse_arguments():
     """
     解析命令行参数
@@ -340,6 +974,73 @@ def parse_arguments():
     parser.add_argument(
         "--log_think", action="store_true", help="Log the agent think step"
     )
+    parser.add_argument(
+        "--workers",
+        type=positive_int,
+        default=1,
+        help="Number of cases to simulate in parallel",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=None,
+        help="Random seed; makes per-case randomness independent of scheduling",
+    )
+    parser.add_argument(
+        "--trace",
+        default=None,
+        help="Write a JSONL trace of agent phases, LLM calls and retrieval here",
+    )
+    parser.add_argument(
+        "--metrics",
+        default=None,
+        help="Write a Prometheus text-format metrics snapshot here",
+    )
+    parser.add_argument(
+        "--headless",
+        action="store_true",
+        help="Skip console rendering and append transcripts to one JSONL file",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default="test_result/ours/1",
+        help="Directory for court session logs or the headless transcript",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Gzip the headless transcript",
+    )
+    parser.add_argument(
+        "--start",
+        type=int,
+        default=0,
+        help="Index of the first case to simulate",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=None,
+        help="Maximum number of cases to take from --start (default: all)",
+    )
+    parser.add_argument(
+        "--shard",
+        type=shard_type,
+        default=(0, 1),
+        metavar="i/N",
+        help="Only simulate cases whose index modulo N is i (0-based)",
+    )
+    parser.add_argument(
+        "--check-config",
+        action="store_true",
+        help="Validate the config and case file without loading any model, then exit",
+    )
+    parser.add_argument(
+        "--startup-budget",
+        type=float,
+        default=2.0,
+        help="Seconds --check-config allows for importing the CLI",
+    )
     return parser.parse_args()
 
 
@@ -348,8 +1049,33 @@ def main():
     主函数
     """
     args = parse_arguments()
-    simulation = CourtSimulation(args.config, args.case, args.log_level, args.log_think)
-    simulation.run_simulation()
+    if args.check_config:
+        sys.exit(check_config(args))
+    if args.trace or args.metrics:
+        tracing.configure(args.trace, args.metrics)
+    if args.headless:
+        console.quiet = True
+    simulation = None
+    try:
+        simulation = CourtSimulation(
+            args.config,
+            args.case,
+            args.log_level,
+            args.log_think,
+            workers=args.workers,
+            seed=args.seed,
+            headless=args.headless,
+            output_dir=args.output_dir,
+            compress=args.compress,
+            start=args.start,
+            limit=args.limit,
+            shard=args.shard,
+        )
+        simulation.run_simulation()
+    finally:
+        if simulation is not None and simulation.transcript is not None:
+            simulation.transcript.close()
+        tracing.shutdown()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+import json
+
+from cases import CaseSource
+from checkpoint import CaseCheckpoint
+
+
+def write_cases(path, count):
+    with open(path, "w", encoding="utf-8") as f:
+        for index in range(count):
+            f.write(json.dumps({"id": index}) + "\n")
+
+
+def test_checkpoints_are_isolated_by_source(tmp_path):
+    write_cases(tmp_path / "a.jsonl", 10)
+    write_cases(tmp_path / "b.jsonl", 10)
+    source_a = CaseSource(str(tmp_path / "a.jsonl")).key
+    source_b = CaseSource(str(tmp_path / "b.jsonl")).key
+    directory = str(tmp_path / "checkpoints")
+
+    # 数据集 A 的案例 3 中断在判决阶段
+    CaseCheckpoint(directory, source_a, 3).update(stage="judgment")
+
+    # 之后在同一目录下运行数据集 B，既看不到也不会恢复 A 的断点
+    assert CaseCheckpoint.pending(directory, source_b) == []
+    assert CaseCheckpoint.load(directory, source_b, 3) is None
+
+    assert CaseCheckpoint.pending(directory, source_a) == [3]
+    assert CaseCheckpoint.load(directory, source_a, 3).stage == "judgment"
+
+
+def test_source_key_depends_on_range_and_shard(tmp_path):
+    path = str(tmp_path / "a.jsonl")
+    write_cases(path, 10)
+    keys = {
+        CaseSource(path).key,
+        CaseSource(path, start=5).key,
+        CaseSource(path, shard=(1, 2)).key,
+    }
+    assert len(keys) == 3
+
+
+def test_load_rejects_mismatched_source(tmp_path):
+    directory = str(tmp_path)
+    checkpoint = CaseCheckpoint(directory, "aaaa", 3)
+    checkpoint.update(stage="debate")
+    with open(checkpoint.path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    data["source"] = "bbbb"
+    with open(checkpoint.path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    assert CaseCheckpoint.load(directory, "aaaa", 3) is None
@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from LLM import offlinellm
+from LLM.offlinellm import OfflineLLM
+from LLM.resilience import DeadlineExceeded, deadline
+
+
+class FakeTokenizer:
+    padding_side = "right"
+    pad_token = None
+    eos_token = "</s>"
+
+
+class FakePipeline:
+    """
+    代替 transformers 的 text-generation pipeline，按提示词内容延迟返回
+    """
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.tokenizer = FakeTokenizer()
+
+    def __call__(self, conversations, max_new_tokens, batch_size):
+        time.sleep(self.delay)
+        responses = []
+        for messages in conversations:
+            reply = {"content": f"re: {messages[-1]['content']}"}
+            responses.append([{"generated_text": messages + [reply]}])
+        return responses
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    pipe = FakePipeline(delay=0.2)
+    monkeypatch.setattr(offlinellm, "pipeline", lambda *args, **kwargs: pipe)
+    return OfflineLLM("fake-model", device="cpu", max_batch_size=4, max_wait=0.01)
+
+
+def test_generate_after_deadline_miss(llm):
+    with pytest.raises(DeadlineExceeded):
+        with deadline(0.05):
+            llm.generate("instruction", "first")
+    # 超时的请求不能让合批线程退出，之后的请求仍能正常完成
+    with deadline(5):
+        assert llm.generate("instruction", "second") == "re: second"
+
+
+def test_request_cancelled_while_queued_is_skipped(llm):
+    llm.pipe.delay = 0.3
+    with pytest.raises(DeadlineExceeded):
+        with deadline(0.05):
+            llm.generate("instruction", "first")
+    # 第一批仍在生成时提交并超时的请求在排队中就被取消
+    with pytest.raises(DeadlineExceeded):
+        with deadline(0.05):
+            llm.generate("instruction", "queued")
+    with deadline(5):
+        assert llm.generate("instruction", "third") == "re: third"
@@ -0,0 +1,43 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 与 main.py 中 --startup-budget 的默认值一致
+STARTUP_BUDGET = 2.0
+
+# 在新的解释器中导入 main，避免受当前测试进程已导入模块的影响
+IMPORT_MAIN = """
+import json, sys, time
+start = time.perf_counter()
+import main
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "heavy": [name for name in main.HEAVY_MODULES if name in sys.modules],
+}))
+"""
+
+
+def import_main():
+    pytest.importorskip("rich")
+    pytest.importorskip("tqdm")
+    result = subprocess.run(
+        [sys.executable, "-c", IMPORT_MAIN],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_does_not_load_heavy_modules():
+    assert import_main()["heavy"] == []
+
+
+def test_import_within_startup_budget():
+    assert import_main()["seconds"] < STARTUP_BUDGET
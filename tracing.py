@@ -0,0 +1,270 @@
+import contextvars
+import functools
+import itertools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# 直方图的桶上界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current_span = contextvars.ContextVar("trace_span", default=None)
+_tracer = None
+
+
+class Tracer:
+    """
+    记录调用链（写入 JSONL 文件）以及计数器和耗时直方图（导出为 Prometheus 文本格式）
+    """
+
+    def __init__(self, trace_path=None, metrics_path=None, buffer_size=256):
+        """
+        :param trace_path: 调用链输出文件，为 None 时不记录调用链
+        :param metrics_path: Prometheus 文本格式快照的输出文件
+        :param buffer_size: 调用链缓冲的事件数，达到后写入文件
+        """
+        self.trace_path = trace_path
+        self.metrics_path = metrics_path
+        self.buffer_size = buffer_size
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._counters = defaultdict(float)
+        self._histograms = {}
+        self._trace_file = None
+        if trace_path:
+            directory = os.path.dirname(trace_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._trace_file = open(trace_path, "a", encoding="utf-8")
+
+    def next_id(self):
+        return next(self._ids)
+
+    def emit(self, event):
+        if self._trace_file is None:
+            return
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self._lock:
+            self._buffer.append(line)
+            if len(self._buffer) >= self.buffer_size:
+                self._flush_locked()
+
+    def _flush_locked(self):
+        if self._buffer:
+            self._trace_file.write("\n".join(self._buffer) + "\n")
+            self._trace_file.flush()
+            self._buffer = []
+
+    def inc(self, name, value=1, labels=()):
+        with self._lock:
+            self._counters[(name, labels)] += value
+
+    def observe(self, name, value, labels=()):
+        with self._lock:
+            histogram = self._histograms.get((name, labels))
+            if histogram is None:
+                histogram = self._histograms[(name, labels)] = {
+                    "buckets": [0] * len(LATENCY_BUCKETS),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @staticmethod
+    def _format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        escaped = []
+        for key, value in pairs:
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+            value = value.replace("\n", "\\n")
+            escaped.append(f'{key}="{value}"')
+        return "{" + ",".join(escaped) + "}"
+
+    def prometheus_text(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {
+                key: {**value, "buckets": list(value["buckets"])}
+                for key, value in self._histograms.items()
+            }
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{self._format_labels(labels)} {value:g}")
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                    le = self._format_labels(labels, [("le", f"{bound:g}")])
+                    lines.append(f"{name}_bucket{le} {count}")
+                le = self._format_labels(labels, [("le", "+Inf")])
+                lines.append(f"{name}_bucket{le} {histogram['count']}")
+                label_text = self._format_labels(labels)
+                lines.append(f"{name}_sum{label_text} {histogram['sum']:g}")
+                lines.append(f"{name}_count{label_text} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self):
+        if not self.metrics_path:
+            return
+        directory = os.path.dirname(self.metrics_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 先写临时文件再替换，抓取方不会读到写了一半的快照
+        temp_path = f"{self.metrics_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_path, self.metrics_path)
+
+    def close(self):
+        with self._lock:
+            if self._trace_file is not None:
+                self._flush_locked()
+                self._trace_file.close()
+                self._trace_file = None
+        self.write_metrics()
+
+
+def configure(trace_path=None, metrics_path=None):
+    """
+    开启追踪；未调用时所有埋点只做一次判空检查
+    """
+    global _tracer
+    shutdown()
+    _tracer = Tracer(trace_path, metrics_path)
+    return _tracer
+
+
+def shutdown():
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.close()
+
+
+def enabled():
+    return _tracer is not None
+
+
+def write_metrics():
+    if _tracer is not None:
+        _tracer.write_metrics()
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    if _tracer is not None:
+        _tracer.inc(name, value, _labels(labels))
+
+
+def observe(name, value, **labels):
+    if _tracer is not None:
+        _tracer.observe(name, value, _labels(labels))
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    记录一段调用的起止时间，嵌套的 span 通过 parent_id 关联；
+    经 contextvars 传播到 run_in_context 提交的线程中
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    span_id = tracer.next_id()
+    parent_id = _current_span.get()
+    token = _current_span.set(span_id)
+    start = time.time()
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        _current_span.reset(token)
+        tracer.observe("court_span_seconds", duration, (("span", name),))
+        tracer.emit(
+            {
+                "name": name,
+                "span_id": span_id,
+                "parent_id": parent_id,
+                "start": start,
+                "duration": duration,
+                "thread": threading.current_thread().name,
+                "status": status,
+                **({"attrs": attrs} if attrs else {}),
+            }
+        )
+
+
+def traced(name):
+    """
+    用 span 包裹函数调用的装饰器；未开启追踪时直接调用原函数
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return fn(*args, **kwargs)
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def measured(metric, span_name=None):
+    """
+    统计调用次数、失败次数和耗时，按函数名打 method 标签；同时记录 span
+    """
+
+    def decorator(fn):
+        labels = (("method", fn.__name__),)
+        name = span_name or f"{metric}.{fn.__name__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                with span(name):
+                    return fn(*args, **kwargs)
+            except Exception:
+                tracer.inc(f"court_{metric}_errors_total", 1, labels)
+                raise
+            finally:
+                tracer.inc(f"court_{metric}_calls_total", 1, labels)
+                tracer.observe(
+                    f"court_{metric}_latency_seconds",
+                    time.perf_counter() - start,
+                    labels,
+                )
+
+        return wrapper
+
+    return decorator
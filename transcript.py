@@ -0,0 +1,143 @@
+import gzip
+import json
+import os
+import threading
+from typing import Dict, Iterator, List
+
+try:
+    import fcntl
+except ImportError:  # Windows 上不加锁
+    fcntl = None
+
+
+class TranscriptSink:
+    """
+    把每个案例的发言追加到同一个 JSONL 文件（可选 gzip 压缩）。
+    发言先缓存在内存中，案例结束时整段写入并 fsync，文件中不会出现写了一半的案例；
+    gzip 模式下每个案例是一个独立的 gzip 成员，可以单独解压。
+    每个案例在文件中的偏移量记录在旁边的 .index 文件中，供随机读取。
+    """
+
+    def __init__(self, output_dir: str, compress: bool = False):
+        os.makedirs(output_dir, exist_ok=True)
+        self.compress = compress
+        self.path = os.path.join(
+            output_dir, "transcripts.jsonl.gz" if compress else "transcripts.jsonl"
+        )
+        self.index_path = self.path + ".index"
+        self._lock = threading.Lock()
+        self._pending = {}  # 案例索引 -> 已缓存的行
+        self._file = open(self.path, "ab")
+        self._index = open(self.index_path, "a", encoding="utf-8")
+        self._lock_files()
+        self._truncate_partial_write()
+
+    def _lock_files(self):
+        # 偏移量来自 tell()，启动时还会截断残留数据，多个进程写同一文件会互相破坏
+        if fcntl is None:
+            return
+        try:
+            fcntl.flock(self._index.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            self._index.close()
+            raise RuntimeError(
+                f"{self.path} is being written by another process; "
+                "give each process its own --output-dir"
+            )
+
+    def _truncate_partial_write(self):
+        # 上次运行若在写入过程中崩溃，截掉不完整的索引行以及最后一个案例之后的残留数据
+        end = 0
+        valid = 0
+        with open(self.index_path, "rb") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                valid += len(line)
+                end = max(end, entry["offset"] + entry["length"])
+        if self._index.tell() > valid:
+            self._index.truncate(valid)
+        if self._file.tell() > end:
+            self._file.truncate(end)
+            self._file.seek(end)
+
+    def append(self, case_index: int, entry: Dict[str, str]):
+        record = {"case": case_index, **entry}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._pending.setdefault(case_index, []).append(line)
+
+    def end_case(self, case_index: int):
+        """
+        把案例缓存的发言写入文件并记录索引
+        """
+        with self._lock:
+            lines = self._pending.pop(case_index, [])
+            if not lines:
+                return
+            data = "".join(lines).encode("utf-8")
+            if self.compress:
+                data = gzip.compress(data)
+            offset = self._file.tell()
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            entry = {
+                "case": case_index,
+                "offset": offset,
+                "length": len(data),
+                "utterances": len(lines),
+            }
+            self._index.write(json.dumps(entry) + "\n")
+            self._index.flush()
+            os.fsync(self._index.fileno())
+
+    def write_case(self, case_index: int, entries: List[Dict[str, str]]):
+        for entry in entries:
+            self.append(case_index, entry)
+        self.end_case(case_index)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+            self._index.close()
+
+
+def load_index(path: str) -> Dict[int, Dict[str, int]]:
+    """
+    :param path: 记录文件路径
+    :return: 案例索引 -> {"offset", "length", "utterances"}；同一案例取最后一次写入
+    """
+    index = {}
+    with open(path + ".index", "r", encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line)
+            index[entry["case"]] = entry
+    return index
+
+
+def read_case(path: str, case_index: int, index=None) -> List[Dict[str, str]]:
+    """
+    根据索引直接读取单个案例的发言
+    """
+    entry = (index or load_index(path))[case_index]
+    with open(path, "rb") as f:
+        f.seek(entry["offset"])
+        data = f.read(entry["length"])
+    if path.endswith(".gz"):
+        data = gzip.decompress(data)
+    return [json.loads(line) for line in data.decode("utf-8").splitlines()]
+
+
+def iter_transcript(path: str) -> Iterator[Dict[str, str]]:
+    """
+    顺序读取记录文件中的所有发言
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)